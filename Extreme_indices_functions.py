@@ -117,7 +117,7 @@ def T_minmax(ds_Tmax, time_group):
 
 
 # Percentage of days when TN or TX < 10th percentile 
-def T_10p(dataset, time_group, start_date, end_date):
+def T_10p(dataset, time_group, start_date, end_date, bootstrap=False, n_workers=None, qc=None):
     """ Extreme index: TN10p/TX10p - percentage of days when TN or TX < 10th percentile
         
         Args:
@@ -125,10 +125,16 @@ def T_10p(dataset, time_group, start_date, end_date):
         time_group (string): group data by time_group (e.g. 'M')
         start_date (string): start date of period over which to calculate percentile
         end_date (string): end date of period over which to calculate percentile
+        bootstrap (bool): use the ETCCDI bootstrap for periods in the base period (time_group[1] 'time.month' or 'time.season')
+        n_workers (int): number of processes for the bootstrap (None = number of CPUs)
+        qc (xarray): output of quality_control, if given the days that failed are set to NaN and periods that aren't complete by the ETCCDI rules are NaN
     """    
+    # mask the days that failed quality control
+    if qc is not None:
+        dataset = apply_qc(dataset, qc)
 
     # find the 10th percentile
-    p10 = dataset.sel(time=slice(start_date, end_date)).groupby(time_group[1]).quantile(0.1, dim=['time'])
+    p10 = percentile_threshold(dataset, start_date, end_date, time_group[1], [0.1]).sel(quantile=0.1)
     # group data by month - find min each month
     T_10p_count = dataset.where(dataset < p10).resample(time = time_group[0]).count(dim = 'time')
     
@@ -148,12 +154,20 @@ def T_10p(dataset, time_group, start_date, end_date):
     
     # remove the quantile dimension so I can combine datasets (ie T_90p) later
     del T_10p['quantile']
+    
+    # use the bootstrap percentages for the periods in the base period
+    if bootstrap:
+        T_10p_boot = bootstrap_periods(dataset, start_date, end_date, 0.1, time_group[0], time_group[1], n_workers)
+        T_10p = T_10p.where(T_10p_boot.isnull(), T_10p_boot)
+    
+    if qc is not None:
+        T_10p = complete_periods(T_10p, qc, dataset.name, time_group[0])
 
     return T_10p
 
 
 # Percentage of days when TN or TX > 90th percentile 
-def T_90p(dataset, time_group, start_date, end_date):
+def T_90p(dataset, time_group, start_date, end_date, bootstrap=False, n_workers=None, qc=None):
     """ Extreme index: TN90p/TX90p - percentage of days when TN or TX > 90th percentile
         
         Args:
@@ -161,10 +175,16 @@ def T_90p(dataset, time_group, start_date, end_date):
         time_group (string): group data by time_group (e.g. 'M')
         start_date (string): start date of period over which to calculate percentile
         end_date (string): end date of period over which to calculate percentile
+        bootstrap (bool): use the ETCCDI bootstrap for periods in the base period (time_group[1] 'time.month' or 'time.season')
+        n_workers (int): number of processes for the bootstrap (None = number of CPUs)
+        qc (xarray): output of quality_control, if given the days that failed are set to NaN and periods that aren't complete by the ETCCDI rules are NaN
     """    
+    # mask the days that failed quality control
+    if qc is not None:
+        dataset = apply_qc(dataset, qc)
 
     # find the 10th percentile
-    p90 = dataset.sel(time=slice(start_date, end_date)).groupby(time_group[1]).quantile(0.9, dim=['time'])
+    p90 = percentile_threshold(dataset, start_date, end_date, time_group[1], [0.9]).sel(quantile=0.9)
 
     # group data by month - find min each month
     T_90p_count = dataset.where(dataset > p90).resample(time = time_group[0]).count(dim = 'time')
@@ -185,6 +205,14 @@ def T_90p(dataset, time_group, start_date, end_date):
     
     # remove the quantile dimension so I can combine datasets (ie T_10p) later
     del T_90p['quantile']
+    
+    # use the bootstrap percentages for the periods in the base period
+    if bootstrap:
+        T_90p_boot = bootstrap_periods(dataset, start_date, end_date, 0.9, time_group[0], time_group[1], n_workers)
+        T_90p = T_90p.where(T_90p_boot.isnull(), T_90p_boot)
+    
+    if qc is not None:
+        T_90p = complete_periods(T_90p, qc, dataset.name, time_group[0])
 
     return T_90p
 
@@ -220,166 +248,754 @@ def extreme_range(ds_TNn, ds_TXx):
 
 
 # function to calculate all extreme indices and put them in an xarray
-def extreme_indices(dataset, time_group, start_date, end_date):
+def extreme_indices(dataset, time_group, start_date, end_date, bootstrap=False, n_workers=None, window=None, qc=None):
     
     """ Extreme indices: Calculate selected temperature extreme indices and store them in an xarray. 
         
         Args:
-        dataset (xarray): data set of temperature  containing both Tmin and Tmax
+        dataset (xarray): data set of temperature  containing both Tmin and Tmax (can have a station dimension)
         time_group (string): list of 2 strings to group data by, first input is arg for resample func (e.g. 'M'), second input is groupby arg (e.g. 'time.month')
-        start_date (string): start date of period over which to calculate percentile
-        end_date (string): end date of period over which to calculate percentile
+        start_date (string or list): start date of period over which to calculate percentile, or a list of start dates (one per station)
+        end_date (string or list): end date of period over which to calculate percentile, or a list of end dates (one per station)
+        bootstrap (bool): use the ETCCDI bootstrap for the percentile indices in the base period
+        n_workers (int): number of processes for the bootstrap (None = number of CPUs)
+        window (int): if given, use percentiles for each calendar day from a window of this many days (e.g. 5) instead of each month
+        qc (xarray): output of quality_control, if given the days that failed are set to NaN and periods that aren't complete by the ETCCDI rules are NaN
     """ 
     
-    import xarray as xr 
-    
+    import xarray as xr
+
+    # mask the days that failed quality control
+    if qc is not None:
+        dataset = apply_qc(dataset, qc)
+
     # select out Tmin and Tmax from input dataset
     ds_Tmin = dataset.Tmin
     ds_Tmax = dataset.Tmax
-    
-    # calculate all the extreme indices needed
-    FD = frostdays(ds_Tmin, time_group[0])
-    SU = summerdays(ds_Tmax, time_group[0])
-    ID = icingdays(ds_Tmax, time_group[0])
-    TR = tropicalnights(ds_Tmin, time_group[0])
-    TXx = T_maxmax(ds_Tmax, time_group[0])
-    TNx = T_maxmin(ds_Tmin, time_group[0])
-    TNn = T_minmin(ds_Tmin, time_group[0])
-    TXn = T_minmax(ds_Tmax, time_group[0])
-    TN10p = monthly_10p(ds_Tmin, start_date, end_date)
-    TX10p = monthly_10p(ds_Tmax, start_date, end_date)
-    TN90p = monthly_90p(ds_Tmin, start_date, end_date)
-    TX90p = monthly_90p(ds_Tmax, start_date, end_date)
-    DTR = daily_range(ds_Tmin, ds_Tmax, time_group[0])
-    ETR = extreme_range(TNn, TXx)
-    
+
+    # calculate the threshold counts, extremes and DTR in a single pass over the daily data
+    fused = fused_indices(ds_Tmin, ds_Tmax, time_group[0])
+    if qc is not None:
+        sources = {'FD': 'Tmin', 'SU': 'Tmax', 'ID': 'Tmax', 'TR': 'Tmin', 'TXx': 'Tmax', 'TNx': 'Tmin', 'TNn': 'Tmin', 'TXn': 'Tmax', 'DTR': ['Tmin', 'Tmax']}
+        fused = {name: complete_periods(index, qc, sources[name], time_group[0]) for name, index in fused.items()}
+    # calculate the 10th and 90th percentile indices together for Tmin and Tmax
+    TN_p = monthly_percentiles(ds_Tmin, start_date, end_date, [0.1, 0.9], bootstrap, n_workers, window, qc=qc)
+    TX_p = monthly_percentiles(ds_Tmax, start_date, end_date, [0.1, 0.9], bootstrap, n_workers, window, qc=qc)
+    ETR = extreme_range(fused['TNn'], fused['TXx'])
+
     # put all indicies into one xarray
-    indicies = xr.Dataset({'FD': FD, 'SU': SU, 'ID': ID, 'TR': TR, 'TXx': TXx, 'TNx': TNx, 'TNn': TNn, 'TXn': TXn, 'TN10p': TN10p, 'TX10p': TX10p, 'TN90p': TN90p, 'TX90p': TX90p, 'DTR': DTR, 'ETR': ETR})
-    
+    indicies = xr.Dataset({'FD': fused['FD'], 'SU': fused['SU'], 'ID': fused['ID'], 'TR': fused['TR'], 'TXx': fused['TXx'], 'TNx': fused['TNx'], 'TNn': fused['TNn'], 'TXn': fused['TXn'], 'TN10p': TN_p[0.1], 'TX10p': TX_p[0.1], 'TN90p': TN_p[0.9], 'TX90p': TX_p[0.9], 'DTR': fused['DTR'], 'ETR': ETR})
+
     return indicies
+
+
+# names of the indices calculated by fused_indices (in the order the kernel returns them)
+fused_names = ['FD', 'SU', 'ID', 'TR', 'TXx', 'TNx', 'TNn', 'TXn', 'DTR']
+
+
+# find the periods resample(time=time_group) would group the daily data into
+def period_bins(time, time_group):
+    """ Find the periods that resample(time=time_group) groups the daily data into, so the grouping can be done once and reused.
+        The time axis must be sorted.
+
+        Args:
+        time (array): daily time values (e.g. dataset.time.data)
+        time_group (string): group data by time_group (e.g. 'M', 'Y')
+
+        Returns:
+        labels (array): time label of each period (same as resample)
+        starts (array): index of the first day of each period
+        counts (array): number of days in each period (0 if there are no days in a period)
+    """
+    import numpy as np, pandas as pd
+
+    # count the days in each period (pandas uses the same bins as xarray's resample)
+    counts = pd.Series(np.ones(len(time)), index=pd.DatetimeIndex(time)).resample(time_group).count()
+    # days are sorted, so each period is a contiguous block starting after the previous period's days
+    starts = np.concatenate([[0], np.cumsum(counts.values)[:-1]]).astype(np.int64)
+
+    return counts.index.values, starts, counts.values.astype(np.int64)
+
+
+# numpy kernel that reduces each period of daily data to all the threshold/extreme indices at once
+def fused_kernel(Tmin, Tmax, starts, counts):
+    """ Calculate FD, SU, ID, TR, TXx, TNx, TNn, TXn and DTR for each period in one reduction pass (time must be the last axis).
+
+        Args:
+        Tmin (array): daily minimum temperature
+        Tmax (array): daily maximum temperature
+        starts (array): index of the first day of each period (from period_bins)
+        counts (array): number of days in each period (from period_bins)
+    """
+    import numpy as np
+
+    # periods with no days would otherwise pick up the value of the next day in reduceat
+    empty = counts == 0
+
+    # threshold counts (NaN values compare as False, so they aren't counted, same as where().count())
+    FD = np.add.reduceat(Tmin < 2, starts, axis=-1, dtype=np.int64)
+    SU = np.add.reduceat(Tmax > 25, starts, axis=-1, dtype=np.int64)
+    ID = np.add.reduceat(Tmax < 0, starts, axis=-1, dtype=np.int64)
+    TR = np.add.reduceat(Tmin > 20, starts, axis=-1, dtype=np.int64)
+
+    # extremes (fmax/fmin skip NaN values unless the whole period is NaN)
+    TXx = np.fmax.reduceat(Tmax, starts, axis=-1)
+    TNx = np.fmax.reduceat(Tmin, starts, axis=-1)
+    TNn = np.fmin.reduceat(Tmin, starts, axis=-1)
+    TXn = np.fmin.reduceat(Tmax, starts, axis=-1)
+
+    # mean daily temperature range, skipping days where either Tmin or Tmax is missing
+    dtr = Tmax - Tmin
+    valid = ~np.isnan(dtr)
+    dtr_sum = np.add.reduceat(np.where(valid, dtr, 0), starts, axis=-1)
+    dtr_n = np.add.reduceat(valid, starts, axis=-1, dtype=np.int64)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        DTR = dtr_sum / dtr_n
+
+    # periods with no days are NaN (resample does the same, which also makes the counts float)
+    if empty.any():
+        FD, SU, ID, TR = [count.astype(float) for count in [FD, SU, ID, TR]]
+        for index in [FD, SU, ID, TR, TXx, TNx, TNn, TXn, DTR]:
+            index[..., empty] = np.nan
+
+    return FD, SU, ID, TR, TXx, TNx, TNn, TXn, DTR
+
+
+# calculate all the non-percentile indices in a single pass
+def fused_indices(ds_Tmin, ds_Tmax, time_group):
+    """ Extreme indices: FD, SU, ID, TR, TXx, TNx, TNn, TXn and DTR grouped by time_group in a single pass over the daily data.
+        Gives the same values as calling frostdays, summerdays, icingdays, tropicalnights, T_maxmax, T_maxmin, T_minmin, T_minmax and daily_range separately.
+
+        Args:
+        ds_Tmin (xarray): data set of minimum temperature (Tmin)
+        ds_Tmax (xarray): data set of maximum temperature (Tmax)
+        time_group (string): group data by time_group (e.g. 'M', 'Y')
+    """
+    import xarray as xr, numpy as np
+
+    # group the days into periods once
+    labels, starts, counts = period_bins(ds_Tmin.time.data, time_group)
+    # counts are float if any period has no days (so they can be NaN)
+    count_dtype = float if (counts == 0).any() else np.int64
+
+    # reduce every period along the time axis (lazily, chunk by chunk, if the data are dask arrays with one chunk along time)
+    results = xr.apply_ufunc(fused_kernel, ds_Tmin, ds_Tmax,
+                             kwargs={'starts': starts, 'counts': counts},
+                             input_core_dims=[['time'], ['time']],
+                             output_core_dims=[['time']]*len(fused_names),
+                             exclude_dims={'time'},
+                             dask='parallelized',
+                             dask_gufunc_kwargs={'output_sizes': {'time': len(labels)}},
+                             output_dtypes=[count_dtype]*4 + [float]*5)
+
+    # put time back where resample would have it and add the period labels
+    indices = {}
+    for name, index in zip(fused_names, results):
+        indices[name] = index.transpose(*ds_Tmin.dims).assign_coords(time=labels)
+
+    return indices
  
     
-# monthly 
+# percentile thresholds 
 
-def monthly_90p(dataset, start_date, end_date):
-    """ Extreme index: TN10p/TX10p - percentage of days when TN or TX > 90th percentile
+# thresholds kept in memory between calls (least recently used first), and how many to keep
+threshold_store = {}
+threshold_store_size = 64
+# directory to also keep thresholds on disk between sessions (None = memory only)
+threshold_cache_dir = None
+# changed when the way thresholds are calculated changes, so thresholds on disk from an older version aren't reused
+threshold_version = 2
+
+
+# content hash used to look up percentile thresholds in the store
+def threshold_key(base, group, quantiles, window=None):
+    """ Create a key for a set of percentile thresholds from the contents of the base period data, the grouping and the quantiles.
+        For dask arrays the name of the dask graph is used instead, so the data aren't read just to make the key.
+        
+        Args:
+        base (xarray): data over the base period
+        group (string): groupby arg used for the thresholds (e.g. 'time.month', 'time.season')
+        quantiles (list): quantiles of the thresholds (e.g. [0.1, 0.9])
+        window (int): window length in days for calendar day thresholds
+    """
+    import hashlib, numpy as np
+    
+    h = hashlib.sha1()
+    h.update(repr((threshold_version, base.name, base.dims, base.shape, str(base.dtype), group, [float(q) for q in quantiles], window)).encode())
+    # coordinates that aren't along time (e.g. station names) end up on the thresholds
+    for c in base.coords:
+        if 'time' not in base[c].dims:
+            h.update(repr((c, base[c].dims, base[c].values.tolist())).encode())
+    h.update(np.ascontiguousarray(base.time.values).tobytes())
+    if base.chunks is not None:
+        h.update(base.data.name.encode())
+    else:
+        h.update(np.ascontiguousarray(base.values).tobytes())
+    
+    return h.hexdigest()
+
+
+# find percentile thresholds over a base period, reusing them if they have already been calculated
+def percentile_threshold(dataset, start_date, end_date, group, quantiles, cache_dir=None, window=5):
+    """ Find the percentiles of the data over the base period for each group (e.g. each month), i.e. dataset.sel(time=slice(start_date, end_date)).groupby(group).quantile(quantiles, dim=['time']).
+        If group is 'calendar_day' the percentiles are for each calendar day using a window of days centred on that day (see calendar_day_quantile).
+        Thresholds are kept in memory (threshold_store) and, if a cache directory is given, on disk, so they are only calculated once for the same data, base period, grouping and quantiles.
+        Thresholds of dask arrays stay lazy and are only kept in memory.
         
         Args:
         dataset (xarray): data set of either Tmin or Tmax
-        start_date (string): start date of period over which to calculate percentile
-        end_date (string): end date of period over which to calculate percentile
-    """   
-    import xarray as xr, pandas as pd
+        start_date (string or list): start date of period over which to calculate percentile, or a list of start dates (one per station)
+        end_date (string or list): end date of period over which to calculate percentile, or a list of end dates (one per station)
+        group (string): groupby arg for the thresholds (e.g. 'time.month', 'time.season') or 'calendar_day'
+        quantiles (list): quantiles to calculate (e.g. [0.1, 0.9])
+        cache_dir (string): directory to keep thresholds on disk (defaults to threshold_cache_dir, None = memory only)
+        window (int): window length in days for 'calendar_day' thresholds (e.g. 5 for the ETCCDI 5-day window)
+    """
+    import os, xarray as xr
+    
+    if cache_dir is None:
+        cache_dir = threshold_cache_dir
+    
+    base = base_period(dataset, start_date, end_date)
+    if group != 'calendar_day':
+        window = None
+    key = threshold_key(base, group, quantiles, window)
+    
+    if key in threshold_store:
+        # move to the end so it's the most recently used
+        thresholds = threshold_store.pop(key)
+    elif (cache_dir is not None) and os.path.exists(os.path.join(cache_dir, f'{key}.nc')):
+        thresholds = xr.load_dataarray(os.path.join(cache_dir, f'{key}.nc'))
+    else:
+        if group == 'calendar_day':
+            thresholds = calendar_day_quantile(base, quantiles, window)
+        else:
+            thresholds = base.groupby(group).quantile(quantiles, dim=['time'])
+        if (cache_dir is not None) and (thresholds.chunks is None):
+            # write to a temporary file first so a half written file is never read back
+            os.makedirs(cache_dir, exist_ok=True)
+            path = os.path.join(cache_dir, f'{key}.nc')
+            thresholds.to_netcdf(f'{path}.tmp')
+            os.replace(f'{path}.tmp', path)
+    
+    # keep in memory and remove the least recently used thresholds if there are too many
+    threshold_store[key] = thresholds
+    while len(threshold_store) > threshold_store_size:
+        del threshold_store[next(iter(threshold_store))]
     
-    # find the 90th percentile for each month
-    p90 = dataset.sel(time=slice(start_date, end_date)).groupby('time.month').quantile(0.9, dim=['time'])
+    return thresholds
 
-    ds_m = []
-    ds_NaN_m = []
-    months = [1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12]
 
-    # find where any NaN values occur
-    NaN_ds = dataset.isnull() # listed as True if it's a NaN value
+# day of the year in a 366 day calendar, so each calendar day (e.g. 1st March) has the same number every year
+def calendar_day(time):
+    """ Day of the year (1-366) of each time, counted as if every year were a leap year (e.g. 1st March is always day 61). 
+        
+        Args:
+        time (xarray): time coordinate (e.g. dataset.time)
+    """
+    leap = time.dt.is_leap_year
     
-    # loop over 
-    for m in range(1,13):
-        # count number of times daily data above 90p
-        count = dataset.where(dataset.sel(time=(dataset['time.month']==m)) > p90.sel(month=m)).resample(time = '12M').count(dim = 'time')
-        # count the number of NaN values per month 
-        count_NaN = NaN_ds.where(NaN_ds.sel(time=(dataset['time.month']==m))==True).resample(time = '12M').count(dim = 'time')
-        # count number of days per months
-        days_in_mon = dataset.sel(time=(dataset['time.month']==m)).time.dt.days_in_month.resample(time='12M').count(dim='time')
-        # count number of days per month minus any NaN values
-        mon_range = days_in_mon - count_NaN
+    return time.dt.dayofyear + ((~leap) & (time.dt.month > 2))
 
-        T_90p_count = count*100/(mon_range)
+
+# percentiles for each calendar day using a window of days centred on that day 
+def calendar_day_quantile(base, quantiles, window=5):
+    """ Find the percentiles for each calendar day (dayofyear 1-366, see calendar_day) from the window of consecutive days centred on that day 
+        in every year of the base period (the ETCCDI 5-day window, e.g. 27th February - 3rd March in non-leap years). 
+        29th February uses the windows centred on 29th February in the leap years of the base period (or 28th February's percentiles if there are none). 
+        The windows are views of the daily data and all calendar days are found with one sort, instead of a separate quantile call for each day. 
+        Uses the same linear interpolation as quantile and skips NaN values (and days outside the base period). 
         
-        # remove time and month coord
-        del T_90p_count['month']
-#         del T_90p_count['time']
+        Args:
+        base (xarray): data over the base period
+        quantiles (list): quantiles to calculate (e.g. [0.1, 0.9])
+        window (int): window length in days (odd)
+    """
+    import numpy as np, xarray as xr
+    
+    # position of each day on a daily axis from the first day of the base period
+    time = base.time.values
+    offset = ((time - time[0]) // np.timedelta64(1, 'D')).astype(int)
+    # position of the day with each calendar day (0-365) in each year (-1 if there isn't one, e.g. 29th February in non-leap years)
+    day = calendar_day(base.time).values - 1
+    year = base.time.dt.year.values
+    year = year - year.min()
+    slot = np.full((year.max() + 1, 366), -1)
+    slot[year, day] = offset
+    
+    thresholds = xr.apply_ufunc(calendar_day_kernel, base, kwargs={'offset': offset, 'slot': slot, 'quantiles': quantiles, 'window': window},
+                                input_core_dims=[['time']], output_core_dims=[['dayofyear', 'quantile']], 
+                                dask='parallelized', dask_gufunc_kwargs={'output_sizes': {'dayofyear': 366, 'quantile': len(quantiles)}}, 
+                                output_dtypes=[float])
+    thresholds.coords['dayofyear'] = range(1, 367)
+    thresholds.coords['quantile'] = quantiles
+    
+    return thresholds
+
+
+# numpy kernel for calendar_day_quantile
+def calendar_day_kernel(data, offset, slot, quantiles, window):
+    """ Percentiles for each calendar day from a sliding window of consecutive days (time must be the last axis). Returns (..., 366, quantiles). 
         
-        # append percentage for each month (of each year) into one ds
-        ds_m.append(T_90p_count)
+        Args:
+        data (array): daily data over the base period
+        offset (array): position of each day on a daily axis from the first day
+        slot (array): (years, 366) position on the daily axis of each calendar day in each year (-1 if there isn't one)
+        quantiles (list): quantiles to calculate (e.g. [0.1, 0.9])
+        window (int): window length in days
+    """
+    import numpy as np
+    from numpy.lib.stride_tricks import sliding_window_view
+    
+    # put the days on a daily axis with NaN for missing days, and pad with NaN so the windows at the ends only use days in the base period
+    half = window // 2
+    days = np.full(data.shape[:-1] + (offset[-1] + 1 + 2*half,), np.nan)
+    days[..., offset + half] = data
+    # window of consecutive days centred on each day, plus an all NaN window for calendar days that aren't in a year
+    windows = sliding_window_view(days, window, axis=-1)
+    windows = np.concatenate([windows, np.full(data.shape[:-1] + (1, window), np.nan)], axis=-2)
+    
+    # collect the windows from all years for each calendar day
+    nyears = slot.shape[0]
+    windows = windows[..., slot.ravel(), :].reshape(data.shape[:-1] + (nyears, 366, window))
+    windows = np.moveaxis(windows, -3, -2).reshape(data.shape[:-1] + (366, nyears*window))
+    
+    # sort each calendar day's values once (NaN values go to the end)
+    windows = np.sort(windows, axis=-1)
+    n = (~np.isnan(windows)).sum(axis=-1)
+    
+    thresholds = np.full(data.shape[:-1] + (366, len(quantiles)), np.nan)
+    for i, q in enumerate(quantiles):
+        # linear interpolation between the two values either side of the quantile
+        h = (np.maximum(n, 1) - 1)*q
+        lo = np.floor(h).astype(int)
+        hi = np.minimum(lo + 1, np.maximum(n, 1) - 1)
+        v_lo = np.take_along_axis(windows, lo[..., None], axis=-1)[..., 0]
+        v_hi = np.take_along_axis(windows, hi[..., None], axis=-1)[..., 0]
+        thresholds[..., i] = np.where(n > 0, v_lo + (h - lo)*(v_hi - v_lo), np.nan)
+    
+    # 29th February (day 59 from 0) uses 28th February's percentiles if there are no leap days in the base period
+    thresholds[..., 59, :] = np.where(n[..., 59, None] > 0, thresholds[..., 59, :], thresholds[..., 58, :])
+    
+    return thresholds
+
+
+# select the data over the base period (which can be different for each station)
+def base_period(dataset, start_date, end_date):
+    """ Select the data over the base period used for the percentiles. 
+        If start_date and end_date are lists (one per station), days outside each station's own base period are set to NaN, 
+        so the percentiles for all stations can be found in one quantile call (NaN values are skipped by quantile). 
         
-     # recombine all months into one ds and concat over month dimension
-    p90_count = xr.concat(ds_m, dim = 'time', coords = 'minimal')
-#     p90_count.coords['month'] = months
-#     p90_count.coords['time'] = pd.date_range(str(dataset['time.year'][0].data), str(dataset['time.year'][-1].data), freq='YS')
+        Args:
+        dataset (xarray): data set of either Tmin or Tmax
+        start_date (string or list): start date of base period, or a list of start dates (one per station)
+        end_date (string or list): end date of base period, or a list of end dates (one per station)
+    """
+    import numpy as np
     
-    # remove the quantile dimension so I can combine datasets (ie T_10p) later
-    del p90_count['quantile']
+    if np.ndim(start_date) == 0:
+        return dataset.sel(time=slice(start_date, end_date))
+    
+    # only keep the days that are in at least one station's base period
+    in_base = base_mask(dataset, start_date, end_date)
+    days = np.flatnonzero(in_base.any('station').data)
     
+    return dataset.isel(time=days).where(in_base.isel(time=days))
+
+
+# mark the days in the base period (which can be different for each station)
+def base_mask(dataset, start_date, end_date):
+    """ Boolean array that is True for days in the base period, with a station dimension if start_date and end_date are lists (one per station). 
+        Days are matched the same way as sel(time=slice(start_date, end_date)). 
+        
+        Args:
+        dataset (xarray): data set of either Tmin or Tmax
+        start_date (string or list): start date of base period, or a list of start dates (one per station)
+        end_date (string or list): end date of base period, or a list of end dates (one per station)
+    """
+    import numpy as np, xarray as xr
+    
+    index = dataset.indexes['time']
+    if np.ndim(start_date) == 0:
+        in_base = np.zeros(len(index), dtype=bool)
+        in_base[index.slice_indexer(start_date, end_date)] = True
+        return xr.DataArray(in_base, dims=['time'], coords={'time': dataset.time})
+    
+    in_base = np.zeros((len(start_date), len(index)), dtype=bool)
+    for s, (start, end) in enumerate(zip(start_date, end_date)):
+        in_base[s, index.slice_indexer(f'{start}', f'{end}')] = True
+    
+    return xr.DataArray(in_base, dims=['station', 'time'], coords={'station': dataset.station, 'time': dataset.time})
+
+
+# empty the in-memory threshold store
+def clear_threshold_store():
+    """ Remove all percentile thresholds kept in memory (thresholds on disk are kept).
+    """
+    threshold_store.clear()
+
+
+# monthly 
+
+def monthly_90p(dataset, start_date, end_date, bootstrap=False, n_workers=None, window=None, qc=None):
+    """ Extreme index: TN90p/TX90p - percentage of days when TN or TX > 90th percentile
+        
+        Args:
+        dataset (xarray): data set of either Tmin or Tmax
+        start_date (string): start date of period over which to calculate percentile
+        end_date (string): end date of period over which to calculate percentile
+        bootstrap (bool): use the ETCCDI bootstrap for months in the base period
+        n_workers (int): number of processes for the bootstrap (None = number of CPUs)
+        window (int): if given, use percentiles for each calendar day from a window of this many days (e.g. 5) instead of each month
+        qc (xarray): output of quality_control, if given the days that failed are set to NaN and months that aren't complete by the ETCCDI rules are NaN
+    """   
+    # mask the days that failed quality control (monthly_percentiles reuses the valid day counts from qc)
+    if qc is not None:
+        dataset = apply_qc(dataset, qc)
+    p90_count = monthly_percentiles(dataset, start_date, end_date, [0.9], bootstrap, n_workers, window, qc=qc)[0.9]
+
     return p90_count
 
 
 
-def monthly_10p(dataset, start_date, end_date):
+def monthly_10p(dataset, start_date, end_date, bootstrap=False, n_workers=None, window=None, qc=None):
     """ Extreme index: TN10p/TX10p - percentage of days when TN or TX < 10th percentile
         
         Args:
         dataset (xarray): data set of either Tmin or Tmax
         start_date (string): start date of period over which to calculate percentile
         end_date (string): end date of period over which to calculate percentile
+        bootstrap (bool): use the ETCCDI bootstrap for months in the base period
+        n_workers (int): number of processes for the bootstrap (None = number of CPUs)
+        window (int): if given, use percentiles for each calendar day from a window of this many days (e.g. 5) instead of each month
+        qc (xarray): output of quality_control, if given the days that failed are set to NaN and months that aren't complete by the ETCCDI rules are NaN
     """   
-    import xarray as xr, pandas as pd
-    
-    # find the 10th percentile for each month
-    p10 = dataset.sel(time=slice(start_date, end_date)).groupby('time.month').quantile(0.1, dim=['time'])
+    # mask the days that failed quality control (monthly_percentiles reuses the valid day counts from qc)
+    if qc is not None:
+        dataset = apply_qc(dataset, qc)
+    p10_count = monthly_percentiles(dataset, start_date, end_date, [0.1], bootstrap, n_workers, window, qc=qc)[0.1]
 
-    ds_m = []
-    ds_NaN_m = []
-    months = [1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12]
+    return p10_count
 
-    # find where any NaN values occur
-    NaN_ds = dataset.isnull() # listed as True if it's a NaN value
+
+# sum a daily array over each period found by period_bins (periods with no days sum to 0)
+def period_sum(dataset, starts, counts):
+    """ Sum daily data over each period along time, using the periods from period_bins. 
+        
+        Args:
+        dataset (xarray): daily data (e.g. boolean mask of days exceeding a threshold)
+        starts (array): index of the first day of each period (from period_bins)
+        counts (array): number of days in each period (from period_bins)
+    """
+    import xarray as xr, numpy as np
+
+    def sum_kernel(data):
+        total = np.add.reduceat(data, starts, axis=-1, dtype=np.int64)
+        total[..., counts == 0] = 0
+        return total
+
+    # dask arrays need the whole time axis in each chunk
+    if dataset.chunks is not None:
+        dataset = dataset.chunk({'time': -1})
+
+    total = xr.apply_ufunc(sum_kernel, dataset, input_core_dims=[['time']], output_core_dims=[['time']], exclude_dims={'time'},
+                           dask='parallelized', dask_gufunc_kwargs={'output_sizes': {'time': len(starts)}}, output_dtypes=[np.int64])
+
+    return total.transpose(*dataset.dims)
+
+
+# Percentage of days below/above monthly percentiles for every month at once
+def monthly_percentiles(dataset, start_date, end_date, quantiles=[0.1, 0.9], bootstrap=False, n_workers=None, window=None, from_date=None, qc=None, thresholds=None):
+    """ Extreme indices: TN10p/TX10p and TN90p/TX90p - percentage of days in each month when TN or TX is below (quantiles < 0.5) or above (quantiles >= 0.5) the monthly percentile.
+        All the quantiles are found with one quantile call and all months are counted in one grouped reduction. 
+        Returns a dictionary of percentages for each quantile, with the same (month by month) time layout as monthly_10p/monthly_90p.
+        
+        Args:
+        dataset (xarray): data set of either Tmin or Tmax
+        start_date (string or list): start date of period over which to calculate percentile, or a list of start dates (one per station)
+        end_date (string or list): end date of period over which to calculate percentile, or a list of end dates (one per station)
+        quantiles (list): quantiles to calculate (e.g. [0.1, 0.9])
+        bootstrap (bool): use the ETCCDI bootstrap for months in the base period (see bootstrap_percentiles)
+        n_workers (int): number of processes for the bootstrap (None = number of CPUs, 1 = no process pool)
+        window (int): if given, use percentiles for each calendar day from a window of this many days (e.g. 5) instead of each month
+        from_date (string): if given, only calculate the percentages for months from this date (the percentiles still use the whole base period)
+        qc (xarray): output of quality_control (dataset must already be cleaned with apply_qc), reuses its valid day counts and sets months that aren't complete to NaN
+        thresholds (xarray): percentiles already found with percentile_threshold (e.g. for a block of a longer record), instead of finding them from dataset
+    """   
+    import numpy as np, pandas as pd
+    
+    if bootstrap and (window is not None):
+        raise ValueError('the bootstrap is only available for monthly percentiles (window=None)')
+    if bootstrap and (from_date is not None):
+        raise ValueError('the bootstrap needs the whole record (from_date=None)')
+    
+    # find all the percentiles in one go and put them on the daily time axis
+    p_daily = daily_thresholds(dataset, start_date, end_date, quantiles, window, from_date, thresholds)
+    if from_date is not None:
+        dataset = dataset.sel(time=slice(from_date, None))
+    
+    # group the days into months once
+    labels, starts, counts = period_bins(dataset.time.data, 'M')
+    # count number of days per month minus any NaN values (already counted by quality_control if given)
+    if qc is None:
+        mon_range = period_sum(dataset.notnull(), starts, counts)
+    else:
+        mon_range = qc[f'{dataset.name}_valid'].sel(months=labels).rename(months='time').drop_vars('time')
+    
+    # order the months the same way as monthly_10p/monthly_90p (all Januarys, then all Februarys, ...)
+    order = np.lexsort((labels, pd.DatetimeIndex(labels).month))
     
-    # loop over months
-    for m in range(1,13):
-        # count number of times daily data below 10p
-        count = dataset.where(dataset.sel(time=(dataset['time.month']==m)) < p10.sel(month=m)).resample(time = '12M').count(dim = 'time')
-        # count the number of NaN values per month 
-        count_NaN = NaN_ds.where(NaN_ds.sel(time=(dataset['time.month']==m))==True).resample(time = '12M').count(dim = 'time')
-        # count number of days per months
-        days_in_mon = dataset.sel(time=(dataset['time.month']==m)).time.dt.days_in_month.resample(time='12M').count(dim='time')
-        # count number of days per month minus any NaN values
-        mon_range = days_in_mon - count_NaN
+    # percentages for the months in the base period using the bootstrap thresholds (NaN for months outside the base period)
+    if bootstrap:
+        T_p_boot = bootstrap_percentiles(dataset, start_date, end_date, quantiles, starts, counts, n_workers)
+    
+    T_p = {}
+    for q in quantiles:
+        # count number of times daily data is below/above the percentile each month 
+        if q < 0.5:
+            count = period_sum(dataset < p_daily.sel(quantile=q, drop=True), starts, counts)
+        else:
+            count = period_sum(dataset > p_daily.sel(quantile=q, drop=True), starts, counts)
+        
+        # convert the (monthly) count to a percentage
+        T_p_count = count*100/(mon_range)
+        if bootstrap:
+            T_p_count = T_p_count.where(T_p_boot[q].isnull(), T_p_boot[q])
+        if qc is not None:
+            T_p_count = complete_periods(T_p_count.assign_coords(time=labels), qc, dataset.name, 'M')
+        T_p[q] = T_p_count.assign_coords(time=labels).isel(time=order).rename(None)
+    
+    return T_p
+
 
-        T_10p_count = count*100/(mon_range)
+# percentile thresholds for every day 
+def daily_thresholds(dataset, start_date, end_date, quantiles, window=None, from_date=None, thresholds=None):
+    """ Find the monthly (or calendar day) percentiles over the base period and broadcast them onto the daily time axis, 
+        so each day can be compared with its own threshold. Used by the percentile and spell indices so they share the same thresholds. 
         
-        # remove time and month coord
-        del T_10p_count['month']
-#         del T_10p_count['time']
+        Args:
+        dataset (xarray): data set of either Tmin or Tmax
+        start_date (string or list): start date of period over which to calculate percentile, or a list of start dates (one per station)
+        end_date (string or list): end date of period over which to calculate percentile, or a list of end dates (one per station)
+        quantiles (list): quantiles to calculate (e.g. [0.1, 0.9])
+        window (int): if given, use percentiles for each calendar day from a window of this many days (e.g. 5) instead of each month
+        from_date (string): if given, only broadcast the percentiles onto the days from this date
+        thresholds (xarray): percentiles already found with percentile_threshold, instead of finding them from dataset
+    """
+    import numpy as np, xarray as xr
+
+    time = dataset.time.sel(time=slice(from_date, None))
+
+    if window is None:
+        # find all the percentiles for each month in one go
+        p = percentile_threshold(dataset, start_date, end_date, 'time.month', quantiles) if thresholds is None else thresholds
+        dim, labels = 'month', time.dt.month.values
+    else:
+        # find all the percentiles for each calendar day in one go
+        p = percentile_threshold(dataset, start_date, end_date, 'calendar_day', quantiles, window=window) if thresholds is None else thresholds
+        dim, labels = 'dayofyear', calendar_day(time).values
+
+    # broadcast the percentiles onto the daily time axis with a numpy index of each day's month/calendar day,
+    # so dask arrays keep one chunk along time (sel would give a separate chunk for every day)
+    index = p.indexes[dim].get_indexer(labels)
+    if p.chunks is not None:
+        p = p.chunk({dim: -1})
+    p_daily = xr.apply_ufunc(np.take, p, kwargs={'indices': index, 'axis': -1}, input_core_dims=[[dim]], output_core_dims=[['time']],
+                             dask='parallelized', dask_gufunc_kwargs={'output_sizes': {'time': len(index)}}, output_dtypes=[p.dtype])
+
+    return p_daily.assign_coords(time=time.time)
+
+
+# ETCCDI in-base bootstrap of the monthly percentile indices
+def bootstrap_percentiles(dataset, start_date, end_date, quantiles, starts, counts, n_workers=None, group='time.month'):
+    """ Percentage of days below/above the monthly percentiles for months in the base period, using the ETCCDI bootstrap (Zhang et al. 2005) 
+        so in-base years aren't compared against thresholds calculated from themselves. 
+        For each in-base year, that year is removed from the base period and replaced by each of the other (n-1) base years in turn, 
+        the thresholds are recalculated and the percentages averaged over the (n-1) replacements. 
+        The grid points/stations are split across a process pool. Returns a dictionary of percentages for each quantile (NaN for months outside the base period). 
         
-        # append percentage for each month (of each year) into one ds
-        ds_m.append(T_10p_count)
+        Args:
+        dataset (xarray): data set of either Tmin or Tmax
+        start_date (string or list): start date of base period, or a list of start dates (one per station)
+        end_date (string or list): end date of base period, or a list of end dates (one per station)
+        quantiles (list): quantiles to calculate (e.g. [0.1, 0.9])
+        starts (array): index of the first day of each month (from period_bins)
+        counts (array): number of days in each month (from period_bins)
+        n_workers (int): number of processes (None = number of CPUs, 1 = no process pool)
+        group (string): groupby arg of the thresholds, 'time.month' or 'time.season' (seasons are bootstrapped by season year, so December goes with the following January and February)
+    """
+    import os, numpy as np, xarray as xr
+    from concurrent.futures import ProcessPoolExecutor
+    
+    # put the data in a (points, time) array
+    other = [d for d in dataset.dims if d != 'time']
+    data = dataset.transpose(*other, 'time').values
+    shape = data.shape[:-1]
+    data = data.reshape(-1, data.shape[-1])
+    in_base = base_mask(dataset, start_date, end_date).broadcast_like(dataset).transpose(*other, 'time').values.reshape(data.shape)
+    
+    # month (period) index, calendar month (or season) and year (or season year) of each day
+    period = np.repeat(np.arange(len(starts)), counts)
+    month = dataset['time.month'].values
+    year = dataset['time.year'].values
+    if group == 'time.season':
+        month, year = (month % 12)//3, year + month//12
+    elif group != 'time.month':
+        raise ValueError(f"the bootstrap is only available for monthly or seasonal percentiles (group 'time.month' or 'time.season'), not {group}")
+    
+    # split the points into blocks for the process pool
+    if n_workers is None:
+        n_workers = os.cpu_count()
+    blocks = np.array_split(np.arange(data.shape[0]), max(1, min(data.shape[0], n_workers*4)))
+    args = [(data[b], in_base[b], period, month, year, quantiles, len(starts)) for b in blocks]
+    if n_workers == 1:
+        results = [bootstrap_kernel(*a) for a in args]
+    else:
+        with ProcessPoolExecutor(n_workers) as pool:
+            results = list(pool.map(bootstrap_kernel, *zip(*args)))
+    T_p_boot = np.concatenate(results, axis=1)
+    
+    # put the results back into the same layout as period_sum
+    T_p = {}
+    coords = {c: dataset[c] for c in dataset.coords if 'time' not in dataset[c].dims}
+    for i, q in enumerate(quantiles):
+        T_p[q] = xr.DataArray(T_p_boot[i].reshape(shape + (len(starts),)), dims=other + ['time'], coords=coords).transpose(*dataset.dims)
+    
+    return T_p
+
+
+# bootstrap percentages of one quantile on the resample time axis
+def bootstrap_periods(dataset, start_date, end_date, q, time_group, group, n_workers=None):
+    """ Bootstrap percentages (see bootstrap_percentiles) of days below/above one percentile for each period of resample(time=time_group), 
+        labelled the same way as resample so they can replace the in-base periods of T_10p/T_90p (NaN for periods outside the base period). 
         
-     # recombine all months into one ds and concat over month dimension
-    p10_count = xr.concat(ds_m, dim = 'time', coords = 'minimal')
-#     p10_count.coords['month'] = months
-#     p10_count.coords['time'] = pd.date_range(str(dataset['time.year'][0].data), str(dataset['time.year'][-1].data), freq='YS')
+        Args:
+        dataset (xarray): data set of either Tmin or Tmax
+        start_date (string or list): start date of base period, or a list of start dates (one per station)
+        end_date (string or list): end date of base period, or a list of end dates (one per station)
+        q (float): quantile (e.g. 0.1)
+        time_group (string): resample arg of the periods (e.g. 'M', 'QS-DEC')
+        group (string): groupby arg of the thresholds, 'time.month' or 'time.season'
+        n_workers (int): number of processes (None = number of CPUs, 1 = no process pool)
+    """
+    labels, starts, counts = period_bins(dataset.time.data, time_group)
+    T_p = bootstrap_percentiles(dataset, start_date, end_date, [q], starts, counts, n_workers, group)
     
-    # remove the quantile dimension so I can combine datasets (ie T_10p) later
-    del p10_count['quantile']
+    return T_p[q].assign_coords(time=labels)
+
+
+# numpy kernel for bootstrap_percentiles (works on a block of points so it can run in a process pool)
+def bootstrap_kernel(data, in_base, period, month, year, quantiles, n_periods):
+    """ Bootstrap percentages of days below/above the monthly percentiles for the in-base months of a block of points. 
+        The base period values for each month are sorted once, and each threshold (base period without year y, plus year z) 
+        is found from the ranks of year z's values in the sorted base period without year y, so nothing is re-sorted. 
+        Thresholds use the same linear interpolation as quantile. 
+        
+        Args:
+        data (array): (points, time) daily data
+        in_base (array): (points, time) True for days in the base period
+        period (array): index of the month (period) each day is in 
+        month (array): calendar month (or season) of each day
+        year (array): year (or season year) of each day
+        quantiles (list): quantiles to calculate (e.g. [0.1, 0.9])
+        n_periods (int): number of months (periods)
+    """
+    import numpy as np
     
-    return p10_count
+    T_p = np.full((len(quantiles), data.shape[0], n_periods), np.nan)
     
+    for p in range(data.shape[0]):
+        for m in np.unique(month[in_base[p]]):
+            days = in_base[p] & (month == m) & ~np.isnan(data[p])
+            years = np.unique(year[days])
+            if len(years) < 2:
+                continue
+            
+            # sort the base period once, keeping the year of each value
+            order = np.argsort(data[p, days], kind='stable')
+            S = data[p, days][order]
+            S_year = year[days][order]
+            
+            # values of each base year (sorted), padded with inf so they fit in one array
+            V = [S[S_year == y] for y in years]
+            n_V = np.array([len(v) for v in V])
+            V_pad = np.full((len(years), n_V.max()), np.inf)
+            for z, v in enumerate(V):
+                V_pad[z, :len(v)] = v
+            
+            for y_i, y in enumerate(years):
+                # base period without year y (already sorted)
+                S_y = S[S_year != y]
+                # replace year y by each other year z
+                z = np.flatnonzero(years != y)
+                # position of year z's values in the sorted (base period without y + year z)
+                ranks = np.searchsorted(S_y, V_pad[z], side='left') + np.arange(V_pad.shape[1])
+                N = len(S_y) + n_V[z]
+                
+                # days in year y (month m) to compare with the thresholds 
+                values = V[y_i]
+                # month (period) of year y (the whole month is marked even if some days are NaN or outside the base period)
+                periods = np.unique(period[in_base[p] & (month == m) & (year == y)])
+                
+                for q_i, q in enumerate(quantiles):
+                    # linear interpolation between the two values either side of the quantile
+                    h = (N - 1)*q
+                    lo = np.floor(h).astype(int)
+                    hi = np.minimum(lo + 1, N - 1)
+                    threshold = kth_value(S_y, V_pad[z], ranks, n_V[z], lo)
+                    threshold = threshold + (h - lo)*(kth_value(S_y, V_pad[z], ranks, n_V[z], hi) - threshold)
+                    
+                    # average the percentage over the (n-1) replacements
+                    if q < 0.5:
+                        count = (values[None, :] < threshold[:, None]).sum(axis=1)
+                    else:
+                        count = (values[None, :] > threshold[:, None]).sum(axis=1)
+                    T_p[q_i, p, periods] = np.mean(count*100/len(values))
     
+    return T_p
+
+
+# k-th smallest value in the union of a sorted array and (padded, sorted) rows of values
+def kth_value(S, V, ranks, n_V, k):
+    """ Find the k-th smallest value (0-based) of S merged with each row of V, without merging them. 
+        
+        Args:
+        S (array): sorted values
+        V (array): (rows, n) sorted values in each row (padded with inf)
+        ranks (array): (rows, n) position of each value of V in the merged array
+        n_V (array): number of values in each row of V (excluding the padding)
+        k (array): rank to find for each row
+    """
+    import numpy as np
+    
+    rows = np.arange(V.shape[0])
+    # number of values of V before position k
+    c = ((ranks < k[:, None]) & (np.arange(V.shape[1])[None, :] < n_V[:, None])).sum(axis=1)
+    c_i = np.minimum(c, V.shape[1] - 1)
+    # the k-th value is either in V (if one of V's values is at position k) or in S
+    in_V = (c < n_V) & (ranks[rows, c_i] == k)
+    
+    return np.where(in_V, V[rows, c_i], S[np.clip(k - c, 0, len(S) - 1)])
+
+
 # Percentage of days when TN or TX < 10th percentile by season
-def seasonal_10p(dataset, start_date, end_date):
+def seasonal_10p(dataset, start_date, end_date, bootstrap=False, n_workers=None, qc=None):
     """ Extreme index: TN10p/TX10p - percentage of days when TN or TX < 10th percentile
         
         Args:
         dataset (xarray): data set of either Tmin or Tmax
         start_date (string): start date of period over which to calculate percentile
         end_date (string): end date of period over which to calculate percentile
+        bootstrap (bool): use the ETCCDI bootstrap for seasons in the base period
+        n_workers (int): number of processes for the bootstrap (None = number of CPUs)
+        qc (xarray): output of quality_control, if given the days that failed are set to NaN and seasons that aren't complete by the ETCCDI rules are NaN
     """    
-    
-    # first I need to define a new coordinate (seasonyear) so that december gets counted with the adjoining jan and feb
-    seasonyear = (dataset.time.dt.year + (dataset.time.dt.month//12)) 
-    dataset.coords['seasonyear'] = seasonyear
+    # mask the days that failed quality control
+    if qc is not None:
+        dataset = apply_qc(dataset, qc)
     
     # find the 10th percentile
-    p10 = dataset.sel(time=slice(start_date, end_date)).groupby('time.season').quantile(0.1, dim=['time'])
+    p10 = percentile_threshold(dataset, start_date, end_date, 'time.season', [0.1]).sel(quantile=0.1)
     
     # group data by month - find min each month
     T_10p_count = dataset.where(dataset < p10).resample(time = 'QS-DEC').count(dim = 'time')
@@ -400,32 +1016,39 @@ def seasonal_10p(dataset, start_date, end_date):
     
     # convert the (seasonal) count of TN10p to a percentage
     T_10p = T_10p_count_final*100/(season_range_final)
-    # add the time/seasonyear dimension back in 
-    # (since daily data take every 365th entry so i get one value for each year and excelude last year)
-    T_10p.coords['seasonyear'] = seasonyear[:-365].isel(time=slice(0,None,365))
     
     # remove the quantile dimension so I can combine datasets (ie T_90p) later
     del T_10p['quantile']
     
+    # use the bootstrap percentages for the seasons in the base period
+    if bootstrap:
+        T_10p_boot = season_resample(bootstrap_periods(dataset, start_date, end_date, 0.1, 'QS-DEC', 'time.season', n_workers))
+        T_10p = T_10p.where(T_10p_boot.isnull(), T_10p_boot)
+    
+    if qc is not None:
+        T_10p = T_10p.where(season_resample(complete_periods(season_range, qc, dataset.name, 'QS-DEC')).notnull())
+    
     return T_10p 
     
     
 # Percentage of days when TN or TX > 90th percentile by season
-def seasonal_90p(dataset, start_date, end_date):
+def seasonal_90p(dataset, start_date, end_date, bootstrap=False, n_workers=None, qc=None):
     """ Extreme index: TN90p/TX90p - percentage of days when TN or TX > 90th percentile
         
         Args:
         dataset (xarray): data set of either Tmin or Tmax
         start_date (string): start date of period over which to calculate percentile
         end_date (string): end date of period over which to calculate percentile
+        bootstrap (bool): use the ETCCDI bootstrap for seasons in the base period
+        n_workers (int): number of processes for the bootstrap (None = number of CPUs)
+        qc (xarray): output of quality_control, if given the days that failed are set to NaN and seasons that aren't complete by the ETCCDI rules are NaN
     """ 
+    # mask the days that failed quality control
+    if qc is not None:
+        dataset = apply_qc(dataset, qc)
     
-    # first I need to define a new coordinate (seasonyear) so that december gets counted with the adjoining jan and feb
-    seasonyear = (dataset.time.dt.year + (dataset.time.dt.month//12)) 
-    dataset.coords['seasonyear'] = seasonyear
-        
     # perform an operation
-    p90 = dataset.sel(time=slice(start_date, end_date)).groupby('time.season').quantile(0.9, dim=['time'])
+    p90 = percentile_threshold(dataset, start_date, end_date, 'time.season', [0.9]).sel(quantile=0.9)
     
     # group data by season - find count for each season
     T_90p_count = dataset.where(dataset > p90).resample(time='QS-DEC').count(dim = 'time')
@@ -446,85 +1069,110 @@ def seasonal_90p(dataset, start_date, end_date):
     
     # convert the (seasonal) count of TN10p to a percentage
     T_90p = T_90p_count_final*100/(season_range_final)
-    # add the time/seasonyear dimension back in 
-    # (since daily data take every 365th entry so i get one value for each year and excelude last year)
-    T_90p.coords['seasonyear'] = seasonyear[:-365].isel(time=slice(0,None,365))
     
     # remove the quantile dimension so I can combine datasets (ie T_90p) later
     del T_90p['quantile']
     
+    # use the bootstrap percentages for the seasons in the base period
+    if bootstrap:
+        T_90p_boot = season_resample(bootstrap_periods(dataset, start_date, end_date, 0.9, 'QS-DEC', 'time.season', n_workers))
+        T_90p = T_90p.where(T_90p_boot.isnull(), T_90p_boot)
+    
+    if qc is not None:
+        T_90p = T_90p.where(season_resample(complete_periods(season_range, qc, dataset.name, 'QS-DEC')).notnull())
+    
     return T_90p
 
 
 # function to resample data by season (since python resample fucntion does'nt do this automatically!!)
 # this function is called in the quantile functions above 
-def season_resample(dataset):
-    import xarray as xr
+def season_resample(dataset, drop_incomplete=True):
+    """ Reshape seasonal data (resampled with 'QS-DEC') into (season, time) with one time step per season year. 
+        December is counted with the following January and February, and the season year of each season is taken from its resample label. 
+        
+        Args:
+        dataset (xarray): data resampled by season, e.g. resample(time='QS-DEC'), (can have a season dimension, e.g. if it was compared with seasonal percentiles)
+        drop_incomplete (bool): drop season years that don't have all four seasons (e.g. the last December, which is the start of the next season year), otherwise fill the missing seasons with NaN
+    """
+    import pandas as pd
     
     seasons = ['DJF', 'MAM', 'JJA', 'SON']
-    dataset_s = []
-    for i, s in enumerate(seasons):
-        
-        # check if ds has 'season' dim
-        if hasattr(dataset, 'season'):
-            # select out each season into an array
-            ds_season = dataset.isel(time=slice(i,None,4)).sel(season=s)
-            # remove season dimension so can create correct new season dim later
-            del ds_season['season']
-            
-        else:
-            # select out each season into an array
-            ds_season = dataset.isel(time=slice(i,None,4))
-        
-        # remove time dimension
-        del ds_season['time']
-
-        # remove the last december from season so each season has the same number of timesteps
-        if i == 0:
-            ds_season = ds_season.sel(time=ds_season.time[:-1])
-
-        # append each season to one 
-        dataset_s.append(ds_season)
-
-    # recombine all seasons into one ds and concat over season dimension
-    ds_final = xr.concat(dataset_s, dim = 'season', coords = 'minimal')
-    ds_final.coords['season'] = seasons
+    labels = pd.DatetimeIndex(dataset.time.data)
+    # position of each season in the year (Dec -> 0, Mar -> 1, Jun -> 2, Sep -> 3) and its season year
+    positions = (labels.month % 12) // 3
+    seasonyears = labels.year + labels.month // 12
+    
+    ds_final = period_reshape(dataset, 'season', seasons, positions, seasonyears, drop_incomplete)
+    # label each season year with 1st January of that year (as before, so sel(time='YYYY') picks season year YYYY)
+    ds_final = ds_final.rename({'year': 'seasonyear'})
+    ds_final.coords['time'] = pd.to_datetime([f'{y}-01-01' for y in ds_final.seasonyear.data])
     
     return ds_final
 
 # function to resample data by month (since python resample fucntion does'nt do this automatically!!)
 # this function is called in the quantile functions above 
-def month_resample(dataset):
-    import xarray as xr
+def month_resample(dataset, drop_incomplete=True):
+    """ Reshape monthly data (resampled with 'M') into (month, time) with one time step per year. 
+        
+        Args:
+        dataset (xarray): data resampled by month, e.g. resample(time='M'), (can have a month dimension, e.g. if it was compared with monthly percentiles)
+        drop_incomplete (bool): drop years that don't have all twelve months, otherwise fill the missing months with NaN
+    """
+    import pandas as pd
     
     months = [1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12]
-    dataset_m = []
-    for i, m in enumerate(months):
-        
-        # check if ds has 'month' dim
-        if hasattr(dataset, 'month'):
-            # select out each season into an array
-            ds_month = dataset.isel(time=slice(i,None,12)).sel(month=m)
-            # remove season dimension so can create correct new season dim later
-            del ds_month['month']
-            
-        else:
-            # select out each month into an array
-            ds_month = dataset.isel(time=slice(i,None,12))
-        
-        # remove time dimension
-        del ds_month['time']
-
-        # remove the last december from season so each season has the same number of timesteps
-#         if i == 0:
-#             ds_month = ds_month.sel(time=ds_month.time[:-1])
+    labels = pd.DatetimeIndex(dataset.time.data)
+    
+    ds_final = period_reshape(dataset, 'month', months, labels.month - 1, labels.year, drop_incomplete)
+    # label each year with its start date
+    ds_final.coords['time'] = pd.to_datetime([f'{y}-01-01' for y in ds_final.year.data])
+    
+    return ds_final
 
-        # append each month to one 
-        dataset_m.append(ds_month)
 
-    # recombine all months into one ds and concat over season dimension
-    ds_final = xr.concat(dataset_m, dim = 'month', coords = 'minimal')
-    ds_final.coords['month'] = months
+# reshape consecutive periods (e.g. seasons, months) along time into (period, year)
+# this function is called in season_resample and month_resample 
+def period_reshape(dataset, dim, periods, positions, years, drop_incomplete):
+    """ Reshape consecutive periods along time into (dim, time) with one time step per year, without copying the data when every year is complete. 
+        Returns the data with a year coordinate along time. 
+        
+        Args:
+        dataset (xarray): data with one time step per period
+        dim (string): name of the period dimension (e.g. 'season', 'month')
+        periods (list): periods in a year, in order (e.g. ['DJF', 'MAM', 'JJA', 'SON'])
+        positions (array): position in periods of each time step
+        years (array): year of each time step
+        drop_incomplete (bool): drop years that don't have all the periods, otherwise fill the missing periods with NaN
+    """
+    import numpy as np, pandas as pd, xarray as xr
+    
+    n = len(periods)
+    positions = np.asarray(positions)
+    
+    # if the data already has a period dimension (e.g. from seasonal thresholds), take each time step's own period
+    if dim in dataset.dims:
+        own = pd.Index(dataset[dim].data).get_indexer(np.asarray(periods)[positions])
+        dataset = dataset.isel({dim: xr.DataArray(own, dims='time')}).drop_vars(dim)
+    
+    # pad the first and last years with NaN so every year has all the periods
+    lead = int(positions[0])
+    trail = n - 1 - int(positions[-1])
+    if lead or trail:
+        dataset = dataset.pad(time=(lead, trail))
+    nyears = dataset.sizes['time'] // n
+    
+    # reshape time into (year, period)
+    def reshape(data):
+        return data.reshape(data.shape[:-1] + (nyears, n))
+    ds_final = xr.apply_ufunc(reshape, dataset.drop_vars('time'), input_core_dims=[['time']], output_core_dims=[['time', dim]], 
+                              exclude_dims={'time'}, dask='allowed')
+    ds_final = ds_final.transpose(dim, *dataset.dims)
+    ds_final.coords[dim] = periods
+    ds_final.coords['year'] = ('time', np.arange(years[0], years[0] + nyears))
+    
+    # drop the first/last year if some periods are missing
+    if drop_incomplete:
+        ds_final = ds_final.isel(time=slice(1 if lead else 0, -1 if trail else None))
     
     return ds_final
 
@@ -538,28 +1186,590 @@ def seasonal_DTR(ds_Tmin, ds_Tmax):
         ds_Tmin (xarray): data set of minimum temperature (Tmax)
         ds_Tmax (xarray): data set of maximum temperature (Tmax)
     """      
-    # first I need to define a new coordinate (seasonyear) so that december gets counted with the adjoining jan and feb
-    seasonyear = (ds_Tmin.time.dt.year + (ds_Tmin.time.dt.month//12)) 
-    ds_Tmin.coords['seasonyear'] = seasonyear
-    
     # calculate teh daily temp range for each quarter (season)
     DTR = (ds_Tmax - ds_Tmin).resample(time='QS-DEC').mean(dim='time')
     
-    # resample by season
+    # resample by season (december gets counted with the adjoining jan and feb in each seasonyear)
     DTR_final = season_resample(DTR)
-    # add the time/seasonyear dimension back in 
-    # (since daily data take every 365th entry so i get one value for each year and excelude last year)
-#     DTR_final.coords['seasonyear'] = seasonyear[:-364].isel(time=slice(0,None,365))
-    DTR_final.coords['seasonyear'] = seasonyear[:-366].isel(time=slice(0,None,365))
-    
 
     return DTR_final 
 
 
+# gridded (out-of-core) extreme indices
+
+# choose dask chunks for calculating the indices: the whole time axis in each chunk, split over the spatial dimensions
+def chunk_for_indices(dataset, max_chunk_mb=256):
+    """ Rechunk a data set so each chunk has the whole time axis (needed for the percentiles) and is split over the other (spatial) dimensions, 
+        with each chunk of a variable no bigger than max_chunk_mb. The last dimensions (e.g. lon) are kept whole where possible so chunks are contiguous. 
+        
+        Args:
+        dataset (xarray): data set of daily temperature (e.g. Tmin and Tmax with time, lat, lon dimensions)
+        max_chunk_mb (float): maximum size of one chunk of one variable in MB (peak memory is a few chunks per dask worker)
+    """
+    import numpy as np
+    
+    # size of the whole time series at one grid point
+    itemsize = max(np.dtype(dataset[v].dtype).itemsize for v in dataset.data_vars) if hasattr(dataset, 'data_vars') else dataset.dtype.itemsize
+    point_bytes = dataset.sizes['time'] * itemsize
+    # number of grid points that fit in one chunk
+    points = max(1, int(max_chunk_mb * 1e6 // point_bytes))
+    
+    chunks = {'time': -1}
+    for dim in reversed([d for d in dataset.dims if d != 'time']):
+        chunks[dim] = max(1, min(dataset.sizes[dim], points))
+        points = max(1, points // dataset.sizes[dim])
+    
+    return dataset.chunk(chunks)
+
+
+# calculate the extreme indices lazily for a gridded data set that doesn't fit in memory 
+def gridded_extreme_indices(dataset, time_group, start_date, end_date, max_chunk_mb=256):
+    """ Extreme indices: Calculate the same indices as extreme_indices for a large (e.g. gridded) data set using dask. 
+        The data are rechunked with chunk_for_indices and every step is kept lazy, so nothing is calculated until the indices are written out (e.g. with write_indices). 
+        
+        Args:
+        dataset (xarray): data set of temperature containing both Tmin and Tmax (e.g. opened with xr.open_dataset(..., chunks={}))
+        time_group (string): list of 2 strings to group data by, first input is arg for resample func (e.g. 'M'), second input is groupby arg (e.g. 'time.month')
+        start_date (string): start date of period over which to calculate percentile
+        end_date (string): end date of period over which to calculate percentile
+        max_chunk_mb (float): maximum size of one chunk of one variable in MB
+    """
+    dataset = chunk_for_indices(dataset[['Tmin', 'Tmax']], max_chunk_mb)
+    
+    return extreme_indices(dataset, time_group, start_date, end_date)
+
+
+# write lazily calculated indices to a netcdf with a limited number of dask workers
+def write_indices(indices, path, num_workers=4):
+    """ Write (lazy) extreme indices to a netcdf, calculating them chunk by chunk. 
+        Peak memory is roughly num_workers * a few chunks (see chunk_for_indices). 
+        
+        Args:
+        indices (xarray): data set of extreme indices (e.g. output of gridded_extreme_indices)
+        path (string): path of the netcdf to write
+        num_workers (int): number of threads used to calculate the chunks
+    """
+    import dask
+    
+    with dask.config.set(scheduler='threads', num_workers=num_workers):
+        indices.to_netcdf(path)
     
+    return path
+
+
+# spell duration indices
+
+# warm spell duration index 
+def warm_spell_duration(ds_Tmax, start_date, end_date, time_group='Y', min_length=6, window=None):
+    """ Extreme index: WSDI - number of days each period in spells of at least min_length consecutive days when TX > 90th percentile. 
+        Uses the same thresholds as TX90p (from percentile_threshold). 
+        
+        Args:
+        ds_Tmax (xarray): data set of maximum temperature (Tmax)
+        start_date (string or list): start date of period over which to calculate percentile, or a list of start dates (one per station)
+        end_date (string or list): end date of period over which to calculate percentile, or a list of end dates (one per station)
+        time_group (string): group data by time_group (e.g. 'Y', 'M')
+        min_length (int): minimum number of consecutive days in a spell
+        window (int): if given, use percentiles for each calendar day from a window of this many days (e.g. 5) instead of each month
+    """
+    p90 = daily_thresholds(ds_Tmax, start_date, end_date, [0.9], window).sel(quantile=0.9, drop=True)
+    WSDI = spell_indices(ds_Tmax > p90, ds_Tmax, time_group, min_length)['days']
     
+    return WSDI
 
 
+# cold spell duration index 
+def cold_spell_duration(ds_Tmin, start_date, end_date, time_group='Y', min_length=6, window=None):
+    """ Extreme index: CSDI - number of days each period in spells of at least min_length consecutive days when TN < 10th percentile. 
+        Uses the same thresholds as TN10p (from percentile_threshold). 
+        
+        Args:
+        ds_Tmin (xarray): data set of minimum temperature (Tmin)
+        start_date (string or list): start date of period over which to calculate percentile, or a list of start dates (one per station)
+        end_date (string or list): end date of period over which to calculate percentile, or a list of end dates (one per station)
+        time_group (string): group data by time_group (e.g. 'Y', 'M')
+        min_length (int): minimum number of consecutive days in a spell
+        window (int): if given, use percentiles for each calendar day from a window of this many days (e.g. 5) instead of each month
+    """
+    p10 = daily_thresholds(ds_Tmin, start_date, end_date, [0.1], window).sel(quantile=0.1, drop=True)
+    CSDI = spell_indices(ds_Tmin < p10, ds_Tmin, time_group, min_length)['days']
+    
+    return CSDI
 
 
+# heatwave indices 
+def heatwaves(ds_Tmax, start_date, end_date, time_group='Y', min_length=3, window=None):
+    """ Extreme indices: heatwaves - spells of at least min_length consecutive days when TX > 90th percentile (same thresholds as TX90p). 
+        Returns an xarray with, for each period: 
+        HWN - number of heatwaves, HWF - number of heatwave days, HWD - length of the longest heatwave, 
+        HWA - peak TX of the hottest heatwave (highest mean TX), HWM - mean TX over all heatwave days. 
+        Heatwaves are counted in the period they start in, heatwave days in the period they occur in. 
+        
+        Args:
+        ds_Tmax (xarray): data set of maximum temperature (Tmax)
+        start_date (string or list): start date of period over which to calculate percentile, or a list of start dates (one per station)
+        end_date (string or list): end date of period over which to calculate percentile, or a list of end dates (one per station)
+        time_group (string): group data by time_group (e.g. 'Y', 'M')
+        min_length (int): minimum number of consecutive days in a heatwave
+        window (int): if given, use percentiles for each calendar day from a window of this many days (e.g. 5) instead of each month
+    """
+    import xarray as xr
+    
+    p90 = daily_thresholds(ds_Tmax, start_date, end_date, [0.9], window).sel(quantile=0.9, drop=True)
+    spells = spell_indices(ds_Tmax > p90, ds_Tmax, time_group, min_length)
+    
+    HW = xr.Dataset({'HWN': spells['events'], 'HWF': spells['days'], 'HWD': spells['longest'], 'HWA': spells['peak'], 'HWM': spells['mean']})
+    
+    return HW
+
+
+# names of the indices calculated by spell_kernel (in the order the kernel returns them)
+spell_names = ['days', 'events', 'longest', 'peak', 'mean']
+
+
+# count spells of consecutive days for each period
+def spell_indices(mask, dataset, time_group, min_length):
+    """ Find spells of at least min_length consecutive days where mask is True and summarise them for each period (see spell_kernel). 
+        Returns a dictionary of days, events, longest, peak and mean for each period. 
+        
+        Args:
+        mask (xarray): daily boolean data (e.g. Tmax > 90th percentile)
+        dataset (xarray): daily data used for the peak and mean of the spells (e.g. Tmax)
+        time_group (string): group data by time_group (e.g. 'Y', 'M')
+        min_length (int): minimum number of consecutive days in a spell
+    """
+    import xarray as xr, numpy as np
+    
+    # group the days into periods once
+    labels, starts, counts = period_bins(dataset.time.data, time_group)
+    count_dtype = float if (counts == 0).any() else np.int64
+    
+    # dask arrays need the whole time axis in each chunk
+    mask = mask.transpose(*dataset.dims)
+    if dataset.chunks is not None:
+        mask = mask.chunk({'time': -1})
+        dataset = dataset.chunk({'time': -1})
+    
+    results = xr.apply_ufunc(spell_kernel, mask, dataset,
+                             kwargs={'starts': starts, 'counts': counts, 'min_length': min_length},
+                             input_core_dims=[['time'], ['time']],
+                             output_core_dims=[['time']]*len(spell_names),
+                             exclude_dims={'time'},
+                             dask='parallelized',
+                             dask_gufunc_kwargs={'output_sizes': {'time': len(labels)}},
+                             output_dtypes=[count_dtype]*3 + [float]*2)
+    
+    spells = {}
+    for name, index in zip(spell_names, results):
+        spells[name] = index.transpose(*dataset.dims).assign_coords(time=labels)
+    
+    return spells
+
+
+# numpy kernel that finds spells with a run length encoding of all points at once
+def spell_kernel(mask, values, starts, counts, min_length):
+    """ Find spells of at least min_length consecutive True days (time must be the last axis) for all points at once and summarise them for each period: 
+        days - number of days in spells, events - number of spells starting in the period, longest - length of the longest spell starting in the period, 
+        peak - highest value of the spell with the highest mean starting in the period, mean - mean value over the days in spells. 
+        
+        Args:
+        mask (array): daily boolean data
+        values (array): daily data for the peak and mean of the spells
+        starts (array): index of the first day of each period (from period_bins)
+        counts (array): number of days in each period (from period_bins)
+        min_length (int): minimum number of consecutive days in a spell
+    """
+    import numpy as np
+    
+    shape = mask.shape[:-1]
+    n_time = mask.shape[-1]
+    n_periods = len(starts)
+    mask = mask.reshape(-1, n_time)
+    values = values.reshape(-1, n_time)
+    n_points = mask.shape[0]
+    
+    # run length encoding: each run of True days starts where the mask goes 0 -> 1 and ends where it goes 1 -> 0
+    edges = np.diff(np.pad(mask.astype(np.int8), [(0, 0), (1, 1)]), axis=1)
+    point, start = np.nonzero(edges == 1)
+    end = np.nonzero(edges == -1)[1]
+    length = end - start
+    
+    # only keep spells that are long enough
+    keep = length >= min_length
+    point, start, end, length = point[keep], start[keep], end[keep], length[keep]
+    
+    # mark the days in spells (+1 at the start and -1 after the end of each spell)
+    in_spell = np.zeros((n_points, n_time + 1), dtype=np.int64)
+    np.add.at(in_spell, (point, start), 1)
+    np.add.at(in_spell, (point, end), -1)
+    in_spell = np.cumsum(in_spell, axis=1)[:, :-1] > 0
+    days = np.add.reduceat(in_spell, starts, axis=1, dtype=np.int64)
+    
+    # mean value over the days in spells 
+    spell_values = np.where(in_spell, values, 0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.add.reduceat(spell_values, starts, axis=1) / days
+    
+    # period each spell starts in (periods with no days share their start with the next period, so take the last one)
+    period = np.searchsorted(starts, start, side='right') - 1
+    events = np.zeros((n_points, n_periods), dtype=np.int64)
+    np.add.at(events, (point, period), 1)
+    longest = np.zeros((n_points, n_periods), dtype=np.int64)
+    np.maximum.at(longest, (point, period), length)
+    
+    # mean and peak value of each spell (from a cumulative sum and a reduceat over each spell, days in spells are never NaN)
+    flat = np.append(values.ravel(), np.nan)
+    cumulative = np.concatenate([np.zeros((n_points, 1)), np.cumsum(np.where(np.isnan(values), 0, values), axis=1)], axis=1)
+    spell_mean = (cumulative[point, end] - cumulative[point, start]) / length
+    bounds = np.stack([point*n_time + start, point*n_time + end], axis=1).ravel()
+    spell_peak = np.fmax.reduceat(flat, bounds)[::2] if len(bounds) else np.zeros(0)
+    
+    # peak of the spell with the highest mean in each period (sort spells by period then mean and take the last of each period)
+    peak = np.full((n_points, n_periods), np.nan)
+    group = point*n_periods + period
+    order = np.lexsort((spell_mean, group))
+    last = order[np.append(group[order][1:] != group[order][:-1], True)] if len(order) else order
+    peak[point[last], period[last]] = spell_peak[last]
+    
+    # periods with no days are NaN
+    indices = [days, events, longest, peak, mean]
+    empty = counts == 0
+    if empty.any():
+        indices = [index.astype(float) for index in indices]
+        for index in indices:
+            index[:, empty] = np.nan
+    
+    return tuple(index.reshape(shape + (n_periods,)) for index in indices)
+
+
+# incremental updates
+
+# update the extreme indices after new daily observations have been added 
+def update_extreme_indices(indices, dataset, time_group, start_date, end_date, window=None, path=None):
+    """ Extreme indices: Update extreme indices (output of extreme_indices, with time in order) after new days have been appended to the daily data. 
+        Only the periods from the last stored period (which may have been incomplete) onwards are recalculated. The percentile thresholds 
+        come from percentile_threshold, so they are reused from the threshold store (or threshold_cache_dir) when the base period data haven't changed. 
+        The new days must be after the base period (bootstrapped in-base months aren't recalculated). 
+        
+        Args:
+        indices (xarray): data set of extreme indices to update (e.g. opened from Obs_extreme_indices_m_v2.nc)
+        dataset (xarray): data set of temperature containing both Tmin and Tmax, including the new days (can be opened lazily, only the base period and the new periods are read)
+        time_group (string): list of 2 strings to group data by, first input is arg for resample func (e.g. 'M'), second input is groupby arg (e.g. 'time.month')
+        start_date (string or list): start date of period over which to calculate percentile, or a list of start dates (one per station)
+        end_date (string or list): end date of period over which to calculate percentile, or a list of end dates (one per station)
+        window (int): if given, use percentiles for each calendar day from a window of this many days (e.g. 5) instead of each month
+        path (string): if given, write the recalculated periods into this netcdf in place (see append_indices)
+    """
+    import numpy as np, pandas as pd, xarray as xr
+    
+    # find the first day of the last stored period
+    labels, starts, counts = period_bins(dataset.time.data, time_group[0])
+    last = np.flatnonzero(labels == indices.time.data[-1])
+    if not len(last):
+        raise ValueError(f'the last stored period ({pd.Timestamp(indices.time.data[-1])}) is not one of the resample(time={time_group[0]!r}) periods of the daily data, '
+                         'check the indices were calculated with the same time_group')
+    first_day = starts[last[0]]
+    from_date = pd.Timestamp(dataset.time.data[first_day])
+    new_days = dataset.isel(time=slice(first_day, None))
+    
+    # recalculate the indices for the new periods
+    fused = fused_indices(new_days.Tmin, new_days.Tmax, time_group[0])
+    TN_p = monthly_percentiles(dataset.Tmin, start_date, end_date, [0.1, 0.9], window=window, from_date=from_date)
+    TX_p = monthly_percentiles(dataset.Tmax, start_date, end_date, [0.1, 0.9], window=window, from_date=from_date)
+    ETR = extreme_range(fused['TNn'], fused['TXx'])
+    new = xr.Dataset({'FD': fused['FD'], 'SU': fused['SU'], 'ID': fused['ID'], 'TR': fused['TR'], 'TXx': fused['TXx'], 'TNx': fused['TNx'], 'TNn': fused['TNn'], 'TXn': fused['TXn'], 'TN10p': TN_p[0.1], 'TX10p': TX_p[0.1], 'TN90p': TN_p[0.9], 'TX90p': TX_p[0.9], 'DTR': fused['DTR'], 'ETR': ETR})
+    
+    # replace the last stored period and add the new ones, keeping the stored dtypes unless the new periods have NaN values (e.g. incomplete periods)
+    kept = indices.sel(time=indices.time < new.time[0])
+    dtypes = {v: indices[v].dtype for v in new.data_vars if (v in indices) and (np.issubdtype(indices[v].dtype, np.floating) or bool(new[v].notnull().all()))}
+    updated = xr.concat([kept, new.assign({v: new[v].astype(dtype) for v, dtype in dtypes.items()})], dim='time')
+    
+    if path is not None:
+        append_indices(new, path)
+    
+    return updated
+
+
+# write new periods of extreme indices into an existing netcdf
+def append_indices(new, path):
+    """ Write new periods of extreme indices into a netcdf in place, overwriting any periods that are already there and appending the rest along time. 
+        The netcdf is created (with an unlimited time dimension so it can be appended to) if it doesn't exist. 
+        If the time dimension of an existing netcdf isn't unlimited, the file is rewritten once with an unlimited time dimension. 
+        
+        Args:
+        new (xarray): data set of extreme indices for the new periods
+        path (string): path of the netcdf
+    """
+    import os, numpy as np, xarray as xr, netCDF4
+    
+    if not os.path.exists(path):
+        new.to_netcdf(path, unlimited_dims=['time'])
+        return path
+    
+    with netCDF4.Dataset(path) as nc:
+        unlimited = nc.dimensions['time'].isunlimited()
+    if not unlimited:
+        # rewrite the file once so it can be appended to in place
+        with xr.open_dataset(path) as old:
+            old = old.load()
+        old.to_netcdf(f'{path}.tmp', unlimited_dims=['time'])
+        os.replace(f'{path}.tmp', path)
+    
+    with netCDF4.Dataset(path, 'a') as nc:
+        time = nc.variables['time']
+        calendar = getattr(time, 'calendar', 'standard')
+        stored = netCDF4.num2date(time[:], time.units, calendar, only_use_cftime_datetimes=False, only_use_python_datetimes=True)
+        stored = np.array(stored, dtype='datetime64[ns]')
+        # first index to write to (the first new period, or the end of the file)
+        i0 = int(np.searchsorted(stored, new.time.data[0]))
+        i1 = i0 + new.sizes['time']
+        
+        time[i0:i1] = netCDF4.date2num(new.indexes['time'].to_pydatetime(), time.units, calendar)
+        for v in new.data_vars:
+            var = nc.variables[v]
+            data = new[v].transpose(*var.dimensions).values
+            # NaN values are written as the variable's fill value (rather than cast to an integer)
+            if np.issubdtype(data.dtype, np.floating):
+                data = np.ma.masked_invalid(data)
+                # integer variables written without a _FillValue get the default fill value as missing_value, so it's read back as NaN
+                if data.mask.any() and (var.dtype.kind in 'iu') and not {'_FillValue', 'missing_value'} & set(var.ncattrs()):
+                    var.setncattr('missing_value', netCDF4.default_fillvals[var.dtype.str[1:]])
+            index = tuple(slice(i0, i1) if d == 'time' else slice(None) for d in var.dimensions)
+            var[index] = data
+    
+    return path
+
+
+
+# quality control
+
+# bits of the quality control flags (see quality_control)
+qc_bits = {'missing': 1, 'sentinel': 2, 'out_of_range': 4, 'Tmin_above_Tmax': 8, 'repeated': 16}
+
+# periods the completeness of each time_group is checked over (by the pandas offset of the time_group, so 'M', 'ME' and 'MS' are all months)
+qc_periods = {('MonthEnd', None): 'month', ('MonthBegin', None): 'month', ('QuarterBegin', 12): 'season', ('YearEnd', 12): 'year', ('YearBegin', 1): 'year'}
+
+
+# quality control of daily Tmin and Tmax, done once and reused by the indices
+def quality_control(dataset, lower=-50, upper=60, sentinel=-100, max_repeat=5, mask=['sentinel', 'out_of_range', 'Tmin_above_Tmax']):
+    """ Quality control of daily Tmin and Tmax in one pass. Returns a data set with a bitmask of flags for each day (see qc_bits),
+        the number of valid days in each month and whether each month, season and year is complete by the ETCCDI rules
+        (no more than 3 days missing in a month, 15 in a year, and a season or year needs all its months to be complete).
+        Give it to extreme_indices (qc=...), or clean the data with apply_qc and give it to monthly_percentiles, so the missing days aren't counted again.
+
+        Args:
+        dataset (xarray): data set of temperature containing both Tmin and Tmax (can have a station dimension)
+        lower (float): lowest plausible temperature (C)
+        upper (float): highest plausible temperature (C)
+        sentinel (float): values at or below this are missing value codes (e.g. -9999.9)
+        max_repeat (int): runs of at least this many days with the same value are flagged as repeated
+        mask (list): flags that make a day missing (repeated values are only flagged by default)
+    """
+    import numpy as np, pandas as pd, xarray as xr
+
+    Tmin = dataset.Tmin.where(dataset.Tmin > sentinel)
+    Tmax = dataset.Tmax.where(dataset.Tmax > sentinel)
+    swapped = Tmin > Tmax
+    masked = sum(qc_bits[m] for m in mask)
+
+    qc = xr.Dataset()
+    for v, T in [('Tmin', Tmin), ('Tmax', Tmax)]:
+        flags = ((dataset[v] <= sentinel)*qc_bits['sentinel'] + ((T < lower) | (T > upper))*qc_bits['out_of_range']
+                 + swapped*qc_bits['Tmin_above_Tmax'] + repeated_days(T, max_repeat)*qc_bits['repeated'])
+        # days that are missing after masking
+        flags = flags + (T.isnull() | (flags & masked != 0))*qc_bits['missing']
+        qc[f'{v}_flags'] = flags.astype(np.uint8)
+    qc.attrs['masked'] = masked
+
+    # count the valid days in each month once
+    labels, starts, counts = period_bins(dataset.time.data, 'M')
+    months = pd.DatetimeIndex(labels)
+    for v in ['Tmin', 'Tmax']:
+        valid = period_sum(qc[f'{v}_flags'] & qc_bits['missing'] == 0, starts, counts).assign_coords(time=labels)
+        complete = valid >= xr.DataArray(months.days_in_month, dims='time', coords={'time': labels}) - 3
+        qc[f'{v}_valid'] = valid.astype(np.uint8).rename(time='months')
+        qc[f'{v}_complete_month'] = complete.rename(time='months')
+
+        # seasons and years are complete if all their months are (and a year has no more than 15 days missing)
+        for period, group, n in [('season', 'QS-DEC', 3), ('year', 'Y', 12)]:
+            p_labels, p_starts, p_counts = period_bins(labels, group)
+            n_complete = period_sum(complete, p_starts, p_counts)
+            ok = n_complete == n
+            if period == 'year':
+                days = xr.DataArray(np.where(pd.DatetimeIndex(p_labels).is_leap_year, 366, 365), dims='time', coords={'time': p_labels})
+                ok = ok & (period_sum(valid, p_starts, p_counts).assign_coords(time=p_labels) >= days - 15)
+            qc[f'{v}_complete_{period}'] = ok.assign_coords(time=p_labels).rename(time=f'{period}s')
+
+    return qc
+
+
+# flag days that are part of a run of repeated values
+def repeated_days(dataset, max_repeat=5):
+    """ Flag days that are part of a run of at least max_repeat days with the same value (e.g. a value copied down a column).
+
+        Args:
+        dataset (xarray): daily data set of Tmin or Tmax
+        max_repeat (int): shortest run of days that is flagged
+    """
+    import numpy as np, xarray as xr
+
+    def repeat_kernel(data):
+        rows = data.reshape(-1, data.shape[-1])
+        # a new run starts at the first day of each row and wherever the value changes (NaN never repeats)
+        new_run = np.ones(rows.shape, dtype=bool)
+        new_run[:, 1:] = rows[:, 1:] != rows[:, :-1]
+        run = np.cumsum(new_run.ravel()) - 1
+        length = np.bincount(run)
+        return (length[run] >= max_repeat).reshape(data.shape)
+
+    if dataset.chunks is not None:
+        dataset = dataset.chunk({'time': -1})
+
+    return xr.apply_ufunc(repeat_kernel, dataset, input_core_dims=[['time']], output_core_dims=[['time']],
+                          dask='parallelized', output_dtypes=[bool]).transpose(*dataset.dims)
+
+
+# set the days that failed quality control to NaN
+def apply_qc(dataset, qc):
+    """ Set the days that failed quality control (the flags in mask when quality_control was called) to NaN.
+
+        Args:
+        dataset (xarray): data set of temperature containing Tmin and/or Tmax, or a single variable named Tmin or Tmax
+        qc (xarray): output of quality_control
+    """
+    import xarray as xr
+
+    if isinstance(dataset, xr.DataArray):
+        return dataset.where(qc[f'{dataset.name}_flags'] & qc_bits['missing'] == 0)
+
+    clean = dataset.copy()
+    for v in ['Tmin', 'Tmax']:
+        if v in dataset:
+            clean[v] = dataset[v].where(qc[f'{v}_flags'] & qc_bits['missing'] == 0)
+
+    return clean
+
+
+# set indices for periods that aren't complete by the ETCCDI rules to NaN
+def complete_periods(index, qc, var, time_group):
+    """ Set an index to NaN for periods that aren't complete by the ETCCDI rules (see quality_control). 
+        time_group has to be months (e.g. 'M', 'ME', 'MS'), seasons (QS-DEC) or years (e.g. 'Y', 'YE', 'YS'), otherwise a ValueError is raised.
+
+        Args:
+        index (xarray): index grouped by time_group (time in order)
+        qc (xarray): output of quality_control
+        var (string): variable the index comes from ('Tmin' or 'Tmax'), or a list of both
+        time_group (string): group the index was calculated with (e.g. 'M', 'Y')
+    """
+    import pandas as pd
+
+    offset = pd.tseries.frequencies.to_offset(time_group)
+    kind = (type(offset).__name__, getattr(offset, 'month', None) or getattr(offset, 'startingMonth', None))
+    if (offset.n != 1) or (kind not in qc_periods):
+        raise ValueError(f'completeness is only checked for months, seasons (QS-DEC) or years, not {time_group!r}')
+    period = qc_periods[kind]
+
+    # match the periods by their month (or year), so periods labelled at the start or the end (e.g. 'MS' or 'M') both work
+    labels = pd.DatetimeIndex(index.time.data)
+    freq = {'month': 'M', 'season': None, 'year': 'Y'}[period]
+    complete = True
+    for v in ([var] if isinstance(var, str) else var):
+        v_complete = qc[f'{v}_complete_{period}'].rename({f'{period}s': 'time'})
+        if freq is not None:
+            v_complete = v_complete.assign_coords(time=pd.DatetimeIndex(v_complete.time.data).to_period(freq)).sel(time=labels.to_period(freq))
+        else:
+            v_complete = v_complete.sel(time=labels)
+        complete = complete & v_complete.assign_coords(time=index.time.data)
+
+    return index.where(complete)
+
+
+# streaming 
+
+# split a daily time axis into blocks of whole periods 
+def period_blocks(time, time_group, block_years=10):
+    """ Split a daily time axis into blocks of about block_years years, only splitting at the start of a period of time_group 
+        that is also the start of a month (so the monthly percentile indices aren't split either). Returns the index of the first and last+1 day of each block.
+        
+        Args:
+        time (array): daily time values (e.g. dataset.time.data)
+        time_group (string): group data by time_group (e.g. 'M', 'Y')
+        block_years (int): number of years in each block
+    """
+    import numpy as np, pandas as pd
+    
+    labels, starts, counts = period_bins(time, time_group)
+    first_days = pd.DatetimeIndex(np.asarray(time)[starts[counts > 0]])
+    splits = starts[counts > 0][first_days.day == 1]
+    years = pd.DatetimeIndex(np.asarray(time)[splits]).year
+    
+    edges = [0]
+    for i, y in zip(splits, years):
+        if y >= pd.Timestamp(time[edges[-1]]).year + block_years:
+            edges.append(int(i))
+    edges.append(len(time))
+    
+    return list(zip(edges[:-1], edges[1:]))
+
+
+# calculate the extreme indices block by block for very long or very wide records
+def stream_indices(dataset, time_group, start_date, end_date, block_years=10, window=None, path=None):
+    """ Extreme indices: Calculate the same indices as extreme_indices block by block (blocks of about block_years years of whole periods),
+        yielding a data set of indices for each block in time order, so memory depends on the block size rather than the record length. 
+        The percentile thresholds are found once from the base period first and then applied to each block (no bootstrap). 
+        
+        Args:
+        dataset (xarray): data set of temperature containing both Tmin and Tmax, opened lazily (e.g. xr.open_dataset) so only one block is read at a time
+        time_group (string): list of 2 strings to group data by, first input is arg for resample func (e.g. 'M'), second input is groupby arg (e.g. 'time.month')
+        start_date (string or list): start date of period over which to calculate percentile, or a list of start dates (one per station)
+        end_date (string or list): end date of period over which to calculate percentile, or a list of end dates (one per station)
+        block_years (int): number of years in each block
+        window (int): if given, use percentiles for each calendar day from a window of this many days (e.g. 5) instead of each month
+        path (string): if given, also write each block into this netcdf as it is finished (see append_indices)
+    """
+    import xarray as xr
+    
+    # find the percentile thresholds over the base period up front
+    group = 'time.month' if window is None else 'calendar_day'
+    thresholds = {v: percentile_threshold(dataset[v], start_date, end_date, group, [0.1, 0.9], window=window) for v in ['Tmin', 'Tmax']}
+    
+    for i0, i1 in period_blocks(dataset.time.data, time_group[0], block_years):
+        block = dataset[['Tmin', 'Tmax']].isel(time=slice(i0, i1)).load()
+        
+        fused = fused_indices(block.Tmin, block.Tmax, time_group[0])
+        TN_p = monthly_percentiles(block.Tmin, start_date, end_date, [0.1, 0.9], window=window, thresholds=thresholds['Tmin'])
+        TX_p = monthly_percentiles(block.Tmax, start_date, end_date, [0.1, 0.9], window=window, thresholds=thresholds['Tmax'])
+        ETR = extreme_range(fused['TNn'], fused['TXx'])
+        
+        # percentile indices back in time order, like the rest of the block
+        indices = xr.Dataset({'FD': fused['FD'], 'SU': fused['SU'], 'ID': fused['ID'], 'TR': fused['TR'], 'TXx': fused['TXx'], 'TNx': fused['TNx'], 'TNn': fused['TNn'], 'TXn': fused['TXn'], 'TN10p': TN_p[0.1].sortby('time'), 'TX10p': TX_p[0.1].sortby('time'), 'TN90p': TN_p[0.9].sortby('time'), 'TX90p': TX_p[0.9].sortby('time'), 'DTR': fused['DTR'], 'ETR': ETR})
+        
+        if path is not None:
+            append_indices(indices, path)
+        
+        yield indices
+
+
+# write the extreme indices to a netcdf block by block
+def write_stream_indices(dataset, time_group, start_date, end_date, path, block_years=10, window=None):
+    """ Calculate the extreme indices block by block with stream_indices and write them to a netcdf as each block is finished, 
+        without keeping the whole record (or all the indices) in memory.
+        
+        Args:
+        dataset (xarray): data set of temperature containing both Tmin and Tmax, opened lazily (e.g. xr.open_dataset)
+        time_group (string): list of 2 strings to group data by, first input is arg for resample func (e.g. 'M'), second input is groupby arg (e.g. 'time.month')
+        start_date (string or list): start date of period over which to calculate percentile, or a list of start dates (one per station)
+        end_date (string or list): end date of period over which to calculate percentile, or a list of end dates (one per station)
+        path (string): path of the netcdf (replaced if it exists)
+        block_years (int): number of years in each block
+        window (int): if given, use percentiles for each calendar day from a window of this many days (e.g. 5) instead of each month
+    """
+    import os
+    
+    if os.path.exists(path):
+        os.remove(path)
+    for indices in stream_indices(dataset, time_group, start_date, end_date, block_years, window, path):
+        pass
+    
+    return path
 
@@ -0,0 +1,194 @@
+# superposed epoch analysis (SEA) functions: composites of the data around each eruption and their significance
+
+
+# find the position of each key date (e.g. eruption date) on the time axis
+def key_positions(time, key_dates):
+    """ Find the position of each key date on the time axis: the first time at or after the key date
+        (e.g. '1883-08' finds 1883-08-31 in monthly data labelled at the end of each month, 1883 finds 1883 in seasonyears).
+
+        Args:
+        time (array): time values of the data (datetimes or years)
+        key_dates (list): key dates (e.g. eruption dates ['1883-08', '1902-10'] or years [1883, 1902])
+    """
+    import numpy as np, pandas as pd
+
+    time = np.asarray(time)
+    if np.issubdtype(time.dtype, np.datetime64):
+        keys = pd.to_datetime([str(k) for k in key_dates]).values
+    else:
+        keys = np.asarray(key_dates, dtype=time.dtype)
+    positions = np.searchsorted(time, keys)
+
+    if (keys < time[0]).any():
+        raise ValueError(f'key dates before the start of the data: {list(np.asarray(key_dates)[keys < time[0]])}')
+    if (positions >= len(time)).any():
+        raise ValueError(f'key dates after the end of the data: {list(np.asarray(key_dates)[positions >= len(time)])}')
+
+    return positions
+
+
+# cut out the window around each key date in one go
+def epochs(dataset, key_dates, before, after, dim='time', names=None):
+    """ Cut out the window from before steps before to after steps after each key date, for all key dates in one gather.
+        Returns an array with (volcano, time) dimensions, where time is the lag from the key date (in time steps, e.g. months),
+        the layout SEA_plots takes. Lags outside the data are NaN.
+
+        Args:
+        dataset (xarray): data set of climate variable (e.g. monthly anomalies), can have other dimensions (e.g. station, lat, lon)
+        key_dates (list): key dates (e.g. eruption dates ['1883-08', '1902-10'] or years [1883, 1902])
+        before (int): number of time steps before each key date (e.g. 60 for 5 years of months)
+        after (int): number of time steps after each key date
+        dim (string): dimension of the time axis (e.g. 'time' or 'seasonyear')
+        names (list): names of the events (e.g. ['Krakatoa', 'Santa Maria']), default is the key dates
+    """
+    import numpy as np, xarray as xr
+
+    positions = key_positions(dataset[dim].values, key_dates)
+    lags = np.arange(-before, after + 1)
+
+    # index of every (event, lag) in the data
+    index = positions[:, None] + lags[None, :]
+    inside = (index >= 0) & (index < dataset.sizes[dim])
+    index = xr.DataArray(np.clip(index, 0, dataset.sizes[dim] - 1), dims=('volcano', 'lag'))
+
+    windows = dataset.isel({dim: index}).where(xr.DataArray(inside, dims=('volcano', 'lag')))
+    windows = windows.drop_vars(dim, errors='ignore').rename(lag='time')
+
+    return windows.assign_coords(volcano=list(names if names is not None else [str(k) for k in key_dates]), time=lags)
+
+
+# composite of the epochs
+def composite(epoch_data):
+    """ Composite (mean over all events, skipping missing values) of the epochs.
+
+        Args:
+        epoch_data (xarray): output of epochs
+    """
+    return epoch_data.mean(dim='volcano')
+
+
+# data for random_composites, kept in each process of the pool (see sea_init) so it's only sent to each process once
+sea_data = {}
+
+
+# pool initializer for random_composites
+def sea_init(data):
+    """ Keep the data for random_composites in this process (used as the process pool initializer).
+
+        Args:
+        data (array): (time, points) data
+    """
+    sea_data['data'] = data
+
+
+# Monte Carlo statistics of random key date composites for a block of points (runs in a process pool so it needs to be at the top of the module)
+def random_composites(points, n_events, lags, sizes, seeds, observed):
+    """ Composites of sum(sizes) sets of n_events random key dates for a block of points of the data kept by sea_init, made in chunks of sizes 
+        (each chunk with its own seed, so the random key dates are the same for every block of points). Each composite is added up one event at a time, 
+        so only (chunk, lag, points) arrays are made. Returns the two sided p-value of the observed composite and the 10th and 90th percentiles 
+        of the random composites, each (lag, points).
+
+        Args:
+        points (slice): block of points (second axis of the data)
+        n_events (int): number of key dates in each composite
+        lags (array): lags from the key dates (in time steps)
+        sizes (list): number of random composites in each chunk
+        seeds (list): seed (SeedSequence) of each chunk
+        observed (array): (lag, points) composite of the key dates for the block of points
+    """
+    import numpy as np, warnings
+
+    data = sea_data['data'][:, points]
+    samples = np.empty((sum(sizes), len(lags), data.shape[1]))
+    i = 0
+    for size, seed in zip(sizes, seeds):
+        rng = np.random.default_rng(seed)
+        # only pick key dates where the whole window fits in the data
+        positions = rng.integers(-lags[0], len(data) - lags[-1], size=(size, n_events))
+        total = np.zeros((size, len(lags), data.shape[1]))
+        count = np.zeros((size, len(lags), data.shape[1]))
+        for e in range(n_events):
+            window = data[positions[:, e, None] + lags[None, :]]
+            valid = np.isfinite(window)
+            total += np.where(valid, window, 0)
+            count += valid
+        # composites with no data at a lag are NaN
+        with np.errstate(invalid='ignore', divide='ignore'):
+            samples[i:i + size] = total/count
+        i += size
+
+    # two sided p-value from the distance to the mean of the random composites, out of the random composites that aren't NaN
+    # (NaN where the composite itself is NaN)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        centre = np.nanmean(samples, axis=0)
+        p10, p90 = np.nanquantile(samples, [0.1, 0.9], axis=0)
+    extreme = (np.abs(samples - centre) >= np.abs(observed - centre)).sum(axis=0)
+    n_finite = np.isfinite(samples).sum(axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        p_value = np.where(np.isfinite(observed) & (n_finite > 0), extreme/n_finite, np.nan)
+
+    return p_value, p10, p90
+
+
+# significance of a composite against composites of random key dates
+def sea_significance(dataset, key_dates, before, after, dim='time', n_samples=10000, seed=0, n_workers=None, chunk_size=250, max_block_mb=256):
+    """ Monte Carlo significance of the composite of the key dates: compares it with n_samples composites of the same number of random key dates.
+        Returns a data set of the composite, the two sided p-value at each lag (fraction of random composites at least as far from the
+        mean of the random composites) and the 10th and 90th percentiles of the random composites (p10 and p90 for SEA_plots), 
+        or a dictionary of these for each variable of a Dataset.
+        The points (e.g. stations or grid points) are split into blocks across a process pool, which gets the data once per process. 
+        The random key dates are made in chunks, each with its own seed from seed, so the result doesn't depend on n_workers.
+
+        Args:
+        dataset (xarray): data set of climate variable (e.g. monthly anomalies), can have other dimensions (e.g. station, lat, lon)
+        key_dates (list): key dates (e.g. eruption dates ['1883-08', '1902-10'] or years [1883, 1902])
+        before (int): number of time steps before each key date
+        after (int): number of time steps after each key date
+        dim (string): dimension of the time axis (e.g. 'time' or 'seasonyear')
+        n_samples (int): number of random composites
+        seed (int): seed for the random number generator
+        n_workers (int): number of processes (None = number of CPUs, 1 = no process pool)
+        chunk_size (int): number of random composites in each chunk
+        max_block_mb (float): maximum size in MB of the random composites of one block of points (peak memory is a few blocks per process)
+    """
+    import os, numpy as np, xarray as xr
+    from concurrent.futures import ProcessPoolExecutor
+
+    # each variable of a Dataset is tested on its own
+    if isinstance(dataset, xr.Dataset):
+        return {v: sea_significance(dataset[v], key_dates, before, after, dim, n_samples, seed, n_workers, chunk_size, max_block_mb) for v in dataset.data_vars}
+
+    comp = composite(epochs(dataset, key_dates, before, after, dim))
+    observed = comp.transpose('time', ...)
+
+    # (time, points) data and (lag, points) composite
+    data = dataset.transpose(dim, ...).values.astype(float)
+    data = data.reshape(len(data), -1)
+    lags = np.arange(-before, after + 1)
+    sizes = [min(chunk_size, n_samples - i) for i in range(0, n_samples, chunk_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+
+    # blocks of points small enough for the random composites to fit in max_block_mb, with at least one block per process
+    n_points = data.shape[1]
+    workers = 1 if n_workers == 1 else (n_workers or os.cpu_count())
+    block = max(1, min(int(max_block_mb*1e6 // (n_samples*len(lags)*8)), -(-n_points // workers)))
+    blocks = [slice(i, min(i + block, n_points)) for i in range(0, n_points, block)]
+    comp_points = observed.values.reshape(len(lags), -1)
+    args = (blocks, [len(key_dates)]*len(blocks), [lags]*len(blocks), [sizes]*len(blocks), [seeds]*len(blocks), [comp_points[:, b] for b in blocks])
+
+    if n_workers == 1:
+        sea_init(data)
+        try:
+            results = list(map(random_composites, *args))
+        finally:
+            sea_data.clear()
+    else:
+        with ProcessPoolExecutor(n_workers, initializer=sea_init, initargs=(data,)) as pool:
+            results = list(pool.map(random_composites, *args))
+    p_value, p10, p90 = [np.concatenate(r, axis=1).reshape(observed.shape) for r in zip(*results)]
+
+    dims = observed.dims
+    result = xr.Dataset({'composite': comp, 'p_value': (dims, p_value), 'p10': (dims, p10), 'p90': (dims, p90)})
+
+    return result.transpose(*comp.dims)
@@ -1,7 +1,7 @@
 # functions used across models, reanalysis and obs sections 
 
 # define function to calculate monthly anomalies for a multidimensional array of models
-def monthly_anomaly(dataset, start_date, end_date):
+def monthly_anomaly(dataset, start_date, end_date, clim=None):
     
     """ Calculate monthly anomalies for a multidimensional array of models.  
         
@@ -9,8 +9,12 @@ def monthly_anomaly(dataset, start_date, end_date):
         dataset (xarray): data set of climate variable (e.g tas)
         start_date (date_str): start date of climatology to calculate monthly anomaly
         end_date (date_str): end date of climatology to calculate monthly anomaly
+        clim (Climatology): climatology already calculated (start_date and end_date are then ignored)
     """
     
+    if clim is not None:
+        return clim.monthly_anomaly(dataset)
+    
     # group the data into months
     variable_monthly = dataset.groupby('time.month')
 
@@ -31,23 +35,116 @@ def seasonal_mean(data):
     """
     return data.groupby('time.season').mean()
 
+# define functions to calculate the seasonal sum, max and min (used with groupby('seasonyear').apply in the notebooks, seasonal_reduce does the same in one pass):
+def seasonal_sum(data):
+    """ Calculate the seasonal sum.  
+        
+        Args:
+        data (xarray): data set of climate variable (e.g FD)
+    """
+    return data.groupby('time.season').sum()
+
+def seasonal_max(data):
+    """ Calculate the seasonal maximum.  
+        
+        Args:
+        data (xarray): data set of climate variable (e.g TXx)
+    """
+    return data.groupby('time.season').max()
+
+def seasonal_min(data):
+    """ Calculate the seasonal minimum.  
+        
+        Args:
+        data (xarray): data set of climate variable (e.g TNn)
+    """
+    return data.groupby('time.season').min()
+
+
+# seasons in the order groupby('time.season') gives them
+season_names = ['DJF', 'JJA', 'MAM', 'SON']
+
+# calculate the seasonal sum/mean/max/min/count for every year in one pass 
+def seasonal_reduce(dataset, how='mean'):
+    """ Calculate the seasonal sum, mean, max, min or count for every year (december counted with the following jan and feb) in one vectorised pass, 
+        instead of groupby('seasonyear').apply(seasonal_mean) which groups by season again for every year. 
+        Returns an array with (seasonyear, season) dimensions, the same as the groupby version. Missing values are skipped, seasons with no data are NaN.
+        
+        Args:
+        dataset (xarray): data set of climate variable (e.g tas)
+        how (string or list): 'sum', 'mean', 'max', 'min' or 'count', or a list of these (returns a dictionary with a result for each)
+    """
+    import numpy as np, xarray as xr
+    
+    hows = [how] if isinstance(how, str) else list(how)
+    
+    # combined seasonyear x season key for each time, found once
+    seasonyear = (dataset.time.dt.year + (dataset.time.dt.month//12)).values
+    years = np.unique(seasonyear)
+    season = np.searchsorted(season_names, dataset.time.dt.season.values)
+    key = np.searchsorted(years, seasonyear)*len(season_names) + season
+    
+    # sort the times by key so each seasonyear x season is one block
+    order = np.argsort(key, kind='stable')
+    key = key[order]
+    starts = np.flatnonzero(np.r_[True, key[1:] != key[:-1]])
+    present = key[starts]
+    
+    def reduce_kernel(data):
+        data = np.asarray(data, dtype=float)[..., order]
+        valid = ~np.isnan(data)
+        results = {}
+        count = np.add.reduceat(valid, starts, axis=-1, dtype=np.int64)
+        total = np.add.reduceat(np.where(valid, data, 0), starts, axis=-1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            reduced = {'sum': total, 'count': count, 'mean': total/count}
+        for h in hows:
+            if h == 'max':
+                reduced[h] = np.fmax.reduceat(data, starts, axis=-1)
+            elif h == 'min':
+                reduced[h] = np.fmin.reduceat(data, starts, axis=-1)
+            # put the seasons into a (seasonyear, season) grid, NaN where there's no data
+            out = np.full(data.shape[:-1] + (len(years)*len(season_names),), np.nan)
+            out[..., present] = reduced[h]
+            results[h] = out.reshape(data.shape[:-1] + (len(years), len(season_names)))
+        return tuple(results[h] for h in hows) if len(hows) > 1 else results[hows[0]]
+    
+    # dask arrays need the whole time axis in each chunk
+    if dataset.chunks:
+        dataset = dataset.chunk({'time': -1})
+    
+    results = xr.apply_ufunc(reduce_kernel, dataset, input_core_dims=[['time']], output_core_dims=[['seasonyear', 'season']]*len(hows),
+                             dask='parallelized', dask_gufunc_kwargs={'output_sizes': {'seasonyear': len(years), 'season': len(season_names)}}, 
+                             output_dtypes=[float]*len(hows))
+    results = results if len(hows) > 1 else (results,)
+    
+    reduced = {}
+    for h, r in zip(hows, results):
+        reduced[h] = r.assign_coords(seasonyear=years, season=season_names).transpose('seasonyear', ..., 'season')
+    
+    return reduced[how] if isinstance(how, str) else reduced
+
 
 # function to calculate a seasonal anomaly for a multidimensional xarray over a time period entered by user
-def seasonal_anomaly(dataset, start_date, end_date):
+def seasonal_anomaly(dataset, start_date, end_date, clim=None):
     """ Calculate a seasonal anomaly for a multidimensional xarray over a time period entered by user.  
         
         Args:
         dataset (xarray): data set of climate variable (e.g tas)
         start_date (date_str): start date to calculate seasonal anomaly
         end_date (date_str): end date to calculate seasonal anomaly
+        clim (Climatology): climatology already calculated (start_date and end_date are then ignored)
     """
+    if clim is not None:
+        return clim.seasonal_anomaly(dataset)
+    
     # first I need to define a new coordinate (seasonyear) so that december gets counted with the adjoining jan and feb
     seasonyear = (dataset.time.dt.year + (dataset.time.dt.month//12)) 
     dataset.coords['seasonyear'] = seasonyear
     
         
     # group data into seasons and calculate the seasonal mean for each year in the dataset 
-    yearly_seasonal = dataset.groupby('seasonyear').apply(seasonal_mean)
+    yearly_seasonal = seasonal_reduce(dataset, 'mean')
 
     # calculate the mean climatology along each season for the time period 
     clim_seasonal = yearly_seasonal.sel(seasonyear = slice(f'{start_date}',f'{end_date}')).mean(dim = 'seasonyear')
@@ -70,10 +167,119 @@ def seasonal_group(dataset):
     
         
     # group data into seasons and calculate the seasonal mean for each year in the dataset 
-    yearly_seasonal = dataset.groupby('seasonyear').apply(seasonal_mean)
+    yearly_seasonal = seasonal_reduce(dataset, 'mean')
     
     return yearly_seasonal
 
+# climatology calculated once and reused for anomalies
+class Climatology:
+    """ Monthly and seasonal climatology (mean, and std and percentiles if asked for) of a data set over a base period, calculated once 
+        and reused to find anomalies of any data set on the same grid (e.g. each eruption window), by broadcasting rather than grouping again.
+        Gives the same anomalies as monthly_anomaly and seasonal_anomaly. Can be saved to a netcdf and loaded again in a later session.
+        
+        Args:
+        dataset (xarray): data set of climate variable (e.g tas)
+        start_date (date_str): start date of the climatology (the seasonal climatology uses the seasonyears from this year)
+        end_date (date_str): end date of the climatology (the seasonal climatology uses the seasonyears up to this year)
+        std (bool): also calculate the standard deviation of each month and season
+        quantiles (list): also calculate these quantiles of each month (e.g. [0.1, 0.9])
+    """
+    
+    # statistics kept by the climatology (each is saved to its own group in the netcdf)
+    stats = ['monthly_mean', 'seasonal_mean', 'monthly_std', 'seasonal_std', 'monthly_quantile']
+    
+    def __init__(self, dataset, start_date, end_date, std=False, quantiles=None):
+        import pandas as pd
+        
+        self.start_date, self.end_date = str(start_date), str(end_date)
+        
+        # monthly statistics over the base period
+        base = dataset.sel(time = slice(f'{start_date}', f'{end_date}'))
+        monthly = base.groupby('time.month')
+        self.monthly_mean = monthly.mean(dim = 'time').load()
+        self.monthly_std = monthly.std(dim = 'time').load() if std else None
+        self.monthly_quantile = monthly.quantile(quantiles, dim = 'time').load() if quantiles is not None else None
+        
+        # seasonal means of each year over the base period seasonyears (december is counted with the following year)
+        first, last = pd.Timestamp(self.start_date).year, pd.Timestamp(self.end_date).year
+        seasonyear = dataset.time.dt.year + (dataset.time.dt.month//12)
+        yearly_seasonal = seasonal_reduce(dataset.sel(time = (seasonyear >= first) & (seasonyear <= last)), 'mean')
+        self.seasonal_mean = yearly_seasonal.mean(dim = 'seasonyear').load()
+        self.seasonal_std = yearly_seasonal.std(dim = 'seasonyear').load() if std else None
+    
+    def monthly_anomaly(self, dataset, standardise=False):
+        """ Monthly anomalies of a data set (lazy if the data set is). 
+            
+            Args:
+            dataset (xarray): data set of climate variable on the same grid as the climatology
+            standardise (bool): divide the anomalies by the monthly standard deviation (needs std=True)
+        """
+        month = dataset.time.dt.month
+        anom = dataset - self.monthly_mean.sel(month = month)
+        if standardise:
+            anom = anom / self.monthly_std.sel(month = month)
+        return anom
+    
+    def seasonal_anomaly(self, dataset, standardise=False):
+        """ Seasonal anomalies of a data set for each year, with (seasonyear, season) dimensions like seasonal_anomaly.  
+            
+            Args:
+            dataset (xarray): data set of climate variable on the same grid as the climatology, with time or already in (seasonyear, season) (e.g. from seasonal_group)
+            standardise (bool): divide the anomalies by the seasonal standard deviation (needs std=True)
+        """
+        yearly_seasonal = seasonal_reduce(dataset, 'mean') if 'time' in dataset.dims else dataset
+        anom = yearly_seasonal - self.seasonal_mean
+        if standardise:
+            anom = anom / self.seasonal_std
+        return anom
+    
+    def save(self, path):
+        """ Save the climatology to a netcdf (each statistic in its own group).
+            
+            Args:
+            path (string): path of the netcdf
+        """
+        import xarray as xr
+        
+        mode = 'w'
+        for stat in self.stats:
+            value = getattr(self, stat)
+            if value is None:
+                continue
+            ds = value.to_dataset(name = value.name or '__xarray_dataarray_variable__') if isinstance(value, xr.DataArray) else value
+            # assign_attrs works on a copy, so the bookkeeping attrs aren't added to the statistic itself
+            ds = ds.assign_attrs(start_date = self.start_date, end_date = self.end_date, dataarray = int(isinstance(value, xr.DataArray)))
+            ds.to_netcdf(path, mode = mode, group = stat)
+            mode = 'a'
+        return path
+    
+    @classmethod
+    def load(cls, path):
+        """ Load a climatology saved with save.
+            
+            Args:
+            path (string): path of the netcdf
+        """
+        import netCDF4, xarray as xr
+        
+        clim = cls.__new__(cls)
+        with netCDF4.Dataset(path) as nc:
+            groups = list(nc.groups)
+        for stat in cls.stats:
+            value = None
+            if stat in groups:
+                with xr.open_dataset(path, group = stat) as ds:
+                    value = ds.load()
+                clim.start_date, clim.end_date = value.attrs['start_date'], value.attrs['end_date']
+                dataarray = value.attrs.pop('dataarray')
+                for a in ['start_date', 'end_date']:
+                    value.attrs.pop(a)
+                if dataarray:
+                    value = value[list(value.data_vars)[0]]
+                    value.name = None if value.name == '__xarray_dataarray_variable__' else value.name
+            setattr(clim, stat, value)
+        return clim
+
 # defines an array of titles for seasonal spatial graphs
 def seasonal_title(K_dates, season_name, season):
     """Create titles for graphs by combining strings for each year, season post-eruption.  
@@ -153,3 +359,47 @@ def nino34(sst_dataset, start_date, end_date, std):
     return nino34_index
     
 
+
+
+# calculate the nino 3.4 index with area weights in one pass over the data
+def nino34_weighted(sst_dataset, start_date, end_date, std, time_chunk=None, max_chunk_mb=128):
+    """ Calculate the NINO34 index like nino34, but with the region mean weighted by the area of each grid cell (cos(lat)) and in one pass over the data:
+        the SST is reduced to the regional mean series one time chunk at a time (out-of-core if sst_dataset is opened lazily with dask), 
+        then the climatology, anomaly, std and 5 month rolling mean are done on the small series in memory.
+        Works on ensembles (any extra dimension, e.g. member, is kept).
+        
+        Args:
+        sst_dataset (xarray): data set of sea surface temperature values (lat, lon, time and any other dimensions)
+        start_date (date_str): start date of climatology and std
+        end_date (date_str): end date of climatology and std
+        std (int): if std==1, calculate the std and divide NINO34 index by std
+        time_chunk (int): number of time steps read at once (default is as many as fit in max_chunk_mb)
+        max_chunk_mb (float): size of each chunk in MB when time_chunk isn't given
+    """
+    import numpy as np
+    
+    # select out the region for nino34 definition
+    region = sst_dataset.sel(lat=slice(-5,5), lon=slice(190,240))
+    
+    # area of each grid cell (missing values get no weight)
+    weights = np.cos(np.deg2rad(region.lat))
+    
+    # reduce to the regional mean in time chunks of a sensible size (not 5 time steps)
+    if region.chunks:
+        if time_chunk is None:
+            step_mb = region.dtype.itemsize*region.size/region.sizes['time']/1e6
+            time_chunk = max(1, int(max_chunk_mb // max(step_mb, 1e-6)))
+        region = region.chunk({'time': time_chunk, 'lat': -1, 'lon': -1})
+    series = region.weighted(weights).mean(dim=['lat','lon']).load()
+    
+    # climatology and anomaly of the regional mean series
+    base = series.sel(time = slice(f'{start_date}', f'{end_date}'))
+    clim = base.groupby('time.month').mean(dim = 'time')
+    anom = (series.groupby('time.month') - clim).drop_vars('month')
+    
+    # 5 month rolling mean, normalised by the std over the base period if asked for
+    nino34_index = anom.rolling(time=5).mean()
+    if std == 1:
+        nino34_index = nino34_index / base.std(dim = 'time')
+    
+    return nino34_index
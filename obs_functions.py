@@ -0,0 +1,617 @@
+# functions to read in and store the daily station observations
+
+# names of the temperature columns in the Bureau of Meteorology daily csvs (IDCJAC0010 is Tmax, IDCJAC0011 is Tmin)
+bom_columns = {'Tmax': 'Maximum temperature (Degree C)', 'Tmin': 'Minimum temperature (Degree C)'}
+bom_products = {'Tmax': 'IDCJAC0010', 'Tmin': 'IDCJAC0011'}
+
+# columns of the station catalog (see build_catalog)
+catalog_columns = ['station', 'name', 'id', 'lat', 'lon', 'variables', 'first', 'last', 'Tmin_completeness', 'Tmax_completeness', 'file', 'mtime']
+
+
+# convert integer year, month and day arrays to datetime64 dates without building strings
+def ymd_to_dates(year, month, day):
+    """ Convert integer year, month and day arrays to datetime64 dates (vectorised, no strings are built).
+
+        Args:
+        year (array): array of years
+        month (array): array of months (1-12)
+        day (array): array of days of the month (1-31)
+    """
+    import numpy as np
+
+    # years since 1970 -> months -> days, all as integer offsets
+    months = (np.asarray(year, dtype='int64') - 1970)*12 + np.asarray(month, dtype='int64') - 1
+    dates = months.astype('datetime64[M]').astype('datetime64[D]') + (np.asarray(day, dtype='int64') - 1)
+
+    return dates.astype('datetime64[ns]')
+
+
+# read the dates and one temperature variable from a Bureau of Meteorology daily csv (or the zip archive it comes in)
+def read_bom_csv(file, var):
+    """ Read the dates and one temperature variable from a Bureau of Meteorology daily csv, only reading the columns needed with compact dtypes.
+        Returns the dates (datetime64) and the temperatures (float32).
+
+        Args:
+        file (string or file): path of the csv, path of the zip archive it comes in (e.g. IDCJAC0010_086071_1800.zip) or an open file
+        var (string): 'Tmax' or 'Tmin'
+    """
+    import zipfile, pandas as pd
+
+    column = bom_columns[var]
+    dtypes = {'Year': 'int16', 'Month': 'int8', 'Day': 'int8', column: 'float32'}
+
+    if isinstance(file, str) and file.endswith('.zip'):
+        # read the csv straight out of the archive without extracting it
+        with zipfile.ZipFile(file) as zf:
+            name = [n for n in zf.namelist() if n.endswith('_Data.csv')][0]
+            with zf.open(name) as f:
+                df = pd.read_csv(f, usecols=list(dtypes), dtype=dtypes)
+    else:
+        df = pd.read_csv(file, usecols=list(dtypes), dtype=dtypes)
+
+    dates = ymd_to_dates(df['Year'].values, df['Month'].values, df['Day'].values)
+
+    return dates, df[column].values
+
+
+# combine the Tmax and Tmin files of a station into an xarray dataset
+def convert_station(max_file, min_file=None, station=None):
+    """ Combine the Tmax (IDCJAC0010) and Tmin (IDCJAC0011) files of a Bureau of Meteorology station into an xarray dataset
+        with Tmin and Tmax along a daily time axis covering both records (days missing from one record are NaN).
+        Replaces convert_df_T + pd.concat in the read in notebooks, the output can be saved straight away with to_netcdf.
+
+        Args:
+        max_file (string or file): csv or zip archive of Tmax (e.g. IDCJAC0010_086071_1800.zip)
+        min_file (string or file): csv or zip archive of Tmin (e.g. IDCJAC0011_086071_1800.zip), if None Tmin is all NaN
+        station (string): name of the station (e.g. 'Melbourne (086071)'), added as a station coordinate if given
+    """
+    import numpy as np, xarray as xr
+
+    records = {'Tmax': read_bom_csv(max_file, 'Tmax')}
+    if min_file is not None:
+        records['Tmin'] = read_bom_csv(min_file, 'Tmin')
+
+    # daily time axis covering both records
+    first = min(dates.min() for dates, T in records.values())
+    last = max(dates.max() for dates, T in records.values())
+    time = np.arange(first, last + np.timedelta64(1, 'D'), np.timedelta64(1, 'D'))
+
+    # put each record straight into its place on the time axis
+    data = {}
+    for var in ['Tmin', 'Tmax']:
+        T = np.full(len(time), np.nan, dtype='float32')
+        if var in records:
+            dates, values = records[var]
+            T[((dates - first)//np.timedelta64(1, 'D')).astype('int64')] = values
+        data[var] = ('time', T, {'units': 'degC'})
+
+    ds = xr.Dataset(data, coords={'time': time})
+    if station is not None:
+        ds.coords['station'] = station
+
+    return ds
+
+
+# find the Tmax and Tmin zip archives for each station
+def station_archives(stations, path=''):
+    """ Find the Tmax (IDCJAC0010) and Tmin (IDCJAC0011) zip archives for each station.
+        Returns a dictionary of station ID: (Tmax archive, Tmin archive or None if there isn't one).
+
+        Args:
+        stations (string or list): directory containing IDCJAC001x_<id>_1800.zip archives (all stations in it are used), or a list of station IDs (e.g. ['086071', '090015'])
+        path (string): directory of the archives when stations is a list of station IDs
+    """
+    import os, re
+
+    if isinstance(stations, str):
+        path = stations
+        pattern = re.compile(r'IDCJAC001[01]_(\w+)_1800\.zip$')
+        stations = sorted({m.group(1) for m in map(pattern.match, os.listdir(path)) if m})
+
+    archives = {}
+    for s in stations:
+        max_file, min_file = [os.path.join(path, f'{bom_products[var]}_{s}_1800.zip') for var in ['Tmax', 'Tmin']]
+        if not os.path.exists(max_file):
+            raise FileNotFoundError(f'no Tmax archive for station {s}: {max_file}')
+        archives[s] = (max_file, min_file if os.path.exists(min_file) else None)
+
+    return archives
+
+
+# stack single station datasets into one dataset with a station dimension
+def stack_stations(datasets, stations):
+    """ Stack single station datasets (e.g. from convert_station) into one dataset with a station dimension, on a daily time axis covering all of them.
+        Each station is copied straight into its place, so there is no alignment step.
+
+        Args:
+        datasets (list): list of xarray datasets with Tmin and Tmax along a daily time axis
+        stations (list): list of station names, one per dataset
+    """
+    import numpy as np, xarray as xr
+
+    first = min(ds.time.values[0] for ds in datasets)
+    last = max(ds.time.values[-1] for ds in datasets)
+    time = np.arange(first, last + np.timedelta64(1, 'D'), np.timedelta64(1, 'D'))
+
+    data = {}
+    for var in ['Tmin', 'Tmax']:
+        T = np.full((len(datasets), len(time)), np.nan, dtype='float32')
+        for i, ds in enumerate(datasets):
+            i0 = (ds.time.values[0] - first)//np.timedelta64(1, 'D')
+            T[i, i0:i0 + ds.sizes['time']] = ds[var].values
+        data[var] = (('station', 'time'), T, {'units': 'degC'})
+
+    return xr.Dataset(data, coords={'station': list(stations), 'time': time})
+
+
+# read in many stations from their zip archives at once
+def load_stations(stations, path='', names=None, n_workers=None, processes=False):
+    """ Read in the Tmax and Tmin zip archives of many Bureau of Meteorology stations concurrently (each csv is read straight out of its archive)
+        and combine them into one dataset with a station dimension.
+
+        Args:
+        stations (string or list): directory containing IDCJAC001x_<id>_1800.zip archives (all stations in it are used), or a list of station IDs (e.g. ['086071', '090015'])
+        path (string): directory of the archives when stations is a list of station IDs
+        names (dict): optional dictionary of station ID: station name (e.g. {'086071': 'Melbourne (086071)'}) to label the stations, otherwise the station ID is used
+        n_workers (int): number of workers (default is the number of cores)
+        processes (bool): if True use a pool of processes instead of threads (faster for many stations, as parsing the csvs is partly limited by the GIL)
+    """
+    from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+    archives = station_archives(stations, path)
+    max_files = [a[0] for a in archives.values()]
+    min_files = [a[1] for a in archives.values()]
+
+    Executor = ProcessPoolExecutor if processes else ThreadPoolExecutor
+    with Executor(n_workers) as pool:
+        datasets = list(pool.map(convert_station, max_files, min_files))
+
+    names = names or {}
+    return stack_stations(datasets, [names.get(s, s) for s in archives])
+
+
+# choose a compact on-disk encoding for each variable of a dataset
+def compact_encoding(dataset, zarr=False, complevel=4, chunk_size=2**18, lossy=False):
+    """ Choose a compact on-disk encoding for each variable of a dataset (daily temperatures or extreme indices):
+        counts of days (non-negative whole numbers, e.g. FD, SU) are stored as uint8 (or uint16 if any count is over 254),
+        temperatures in 0.1 C (e.g. Tmax, TXx) as int16 with scale_factor 0.1 and everything else (e.g. DTR, TN10p) keeps its own dtype, so it reads back exactly. 
+        With lossy=True other values that fit are stored as int16 with scale_factor 0.01 (rounded to 0.01) and the rest as float32. 
+        Everything is compressed and chunked so reading one station's time series or one date across all stations only reads a few chunks.
+
+        Args:
+        dataset (xarray): data set to write
+        zarr (bool): if True return the encoding for to_zarr (blosc compression) instead of to_netcdf (zlib compression)
+        complevel (int): compression level (1-9)
+        chunk_size (int): number of values in each chunk
+        lossy (bool): also pack the other values into int16 (to 0.01) or float32, which is smaller but doesn't read back exactly
+    """
+    import numpy as np, xarray as xr
+
+    # reduce each variable to a few numbers (min, max, whole numbers?, multiples of 0.1?) in one pass,
+    # so chunked (dask) data are read chunk by chunk instead of loaded whole
+    variables = [v for v in dataset.data_vars if np.issubdtype(dataset[v].dtype, np.number)]
+    stats = {}
+    for v in variables:
+        da = dataset[v].astype('float64')
+        da = da.where(np.isfinite(da))
+        stats[f'{v}_min'] = da.min()
+        stats[f'{v}_max'] = da.max()
+        stats[f'{v}_whole'] = ((da == np.round(da)) | da.isnull()).all()
+        stats[f'{v}_tenths'] = ((abs(da*10 - np.round(da*10)) <= 1e-3) | da.isnull()).all()
+    stats = xr.Dataset(stats).compute()
+
+    encoding = {}
+    for v in variables:
+        da = dataset[v]
+        lo, hi = float(stats[f'{v}_min']), float(stats[f'{v}_max'])
+        # no finite values
+        if np.isnan(lo):
+            lo, hi = 0, 0
+        top = max(abs(lo), abs(hi))
+
+        if (lo >= 0) and bool(stats[f'{v}_whole']) and top < 65535:
+            # counts of days
+            dtype = 'uint8' if top < 255 else 'uint16'
+            enc = {'dtype': dtype, '_FillValue': np.iinfo(dtype).max}
+        elif bool(stats[f'{v}_tenths']) and top < 3276:
+            # temperatures to 0.1 C
+            enc = {'dtype': 'int16', 'scale_factor': np.float32(0.1), '_FillValue': np.int16(-32768)}
+        elif not lossy:
+            enc = {'dtype': da.dtype}
+        elif top < 327:
+            enc = {'dtype': 'int16', 'scale_factor': np.float32(0.01), '_FillValue': np.int16(-32768)}
+        else:
+            enc = {'dtype': 'float32'}
+
+        # split the other dimensions into blocks of up to 16 and fill the rest of the chunk along time
+        shape = [min(s, 16) if d != 'time' else s for d, s in zip(da.dims, da.shape)]
+        if 'time' in da.dims:
+            i = da.dims.index('time')
+            shape[i] = int(min(da.shape[i], max(1, chunk_size//max(1, np.prod(shape)//da.shape[i]))))
+        shape = tuple(int(s) for s in shape)
+
+        if zarr:
+            enc.update(chunks=shape, **zarr_compressor(complevel))
+        else:
+            enc.update(chunksizes=shape, zlib=True, complevel=complevel, shuffle=True)
+        encoding[v] = enc
+
+    return encoding
+
+
+# blosc compression for to_zarr, for either version of the zarr library
+def zarr_compressor(complevel=4):
+    """ Encoding for blosc (zstd) compression in to_zarr: zarr 3 takes a list of codecs (compressors) and zarr 2 a single numcodecs compressor (compressor).
+
+        Args:
+        complevel (int): compression level (1-9)
+    """
+    import zarr
+
+    if int(zarr.__version__.split('.')[0]) >= 3:
+        from zarr.codecs import BloscCodec
+        return {'compressors': [BloscCodec(cname='zstd', clevel=complevel, shuffle='shuffle')]}
+
+    from numcodecs import Blosc
+    return {'compressor': Blosc(cname='zstd', clevel=complevel, shuffle=Blosc.SHUFFLE)}
+
+
+# write daily station data or extreme indices in a compact, compressed and chunked format
+def write_compact(dataset, path, complevel=4, lossy=False):
+    """ Write daily station data or extreme indices in a compact, compressed and chunked format (see compact_encoding),
+        several times smaller than the default to_netcdf. Paths ending in .zarr are written as Zarr, otherwise as netcdf4.
+
+        Args:
+        dataset (xarray): data set to write (e.g. obs or ex_indices_m)
+        path (string): path of the output file (e.g. f'{path}Daily_T_Aus_5S_v2.nc')
+        complevel (int): compression level (1-9)
+        lossy (bool): pack values that aren't counts or temperatures to 0.01 (see compact_encoding)
+    """
+    # drop any encoding left over from the file the data were read from
+    dataset = dataset.copy()
+    for v in dataset.variables:
+        dataset[v].encoding = {}
+
+    if path.endswith('.zarr'):
+        encoding = compact_encoding(dataset, zarr=True, complevel=complevel, lossy=lossy)
+        # dask chunks have to line up with the zarr chunks
+        for v, enc in encoding.items():
+            if dataset[v].chunks is not None:
+                dataset[v] = dataset[v].chunk(dict(zip(dataset[v].dims, enc['chunks'])))
+        dataset.to_zarr(path, mode='w', encoding=encoding)
+    else:
+        dataset.to_netcdf(path, format='NETCDF4', engine='netcdf4', encoding=compact_encoding(dataset, complevel=complevel, lossy=lossy))
+
+    return path
+
+
+# open a file written by write_compact
+def open_compact(path, chunks=None):
+    """ Open a file written by write_compact (netcdf or .zarr), unpacking the temperatures and counts back to floats (missing values are NaN).
+
+        Args:
+        path (string): path of the file
+        chunks (dict): passed on to xarray to open the data lazily with dask, use {} for the chunks on disk
+    """
+    import xarray as xr
+
+    if path.rstrip('/').endswith('.zarr'):
+        return xr.open_zarr(path, chunks=chunks)
+    return xr.open_dataset(path, chunks=chunks)
+
+
+# summarise one station netcdf for the station catalog
+def station_summary(file, locations=None):
+    """ Summarise one station netcdf (e.g. 'Melbourne (086071).nc' from to_xr_netcdf or convert_station) for the station catalog:
+        station name and ID, coordinates, variables present, first and last date and the fraction of days with data for each variable.
+
+        Args:
+        file (string): path of the station netcdf
+        locations (dict): optional dictionary of station: (lat, lon), used if the file doesn't have its coordinates
+    """
+    import os, re, numpy as np, xarray as xr
+
+    station = os.path.basename(file)[:-3]
+    match = re.match(r'(.*) \((\w+)\)$', station)
+    name, ID = (match.group(1), match.group(2)) if match else (station, '')
+
+    with xr.open_dataset(file) as d:
+        d = d.rename({'Date': 'time'}) if 'Date' in d.dims else d
+        lat = float(d.attrs.get('latitude', d['lat'] if 'lat' in d.variables else np.nan))
+        lon = float(d.attrs.get('longitude', d['lon'] if 'lon' in d.variables else np.nan))
+        if np.isnan(lat) and locations and station in locations:
+            lat, lon = locations[station]
+        summary = {'station': station, 'name': name, 'id': ID, 'lat': lat, 'lon': lon,
+                   'variables': ';'.join(v for v in ['Tmin', 'Tmax'] if v in d),
+                   'first': d.time.values[0], 'last': d.time.values[-1], 'file': os.path.abspath(file), 'mtime': os.path.getmtime(file)}
+        for v in ['Tmin', 'Tmax']:
+            summary[f'{v}_completeness'] = float(d[v].notnull().mean()) if v in d else 0.0
+
+    return summary
+
+
+# build (or refresh) the catalog of station netcdfs in a directory
+def build_catalog(path, catalog_file=None, locations=None):
+    """ Build (or refresh) the catalog of station netcdfs in a directory and save it as a csv next to them.
+        Files that haven't changed since the catalog was last built aren't opened again.
+
+        Args:
+        path (string): directory of the station netcdfs (e.g. '/g/data/w48/kb6999/Observations/obs_netcdfs_T/')
+        catalog_file (string): path of the catalog csv (default is station_catalog.csv in path)
+        locations (dict): optional dictionary of station: (lat, lon), used for files that don't have their coordinates
+    """
+    import os, pandas as pd
+
+    catalog_file = catalog_file or os.path.join(path, 'station_catalog.csv')
+    old = read_catalog(catalog_file).set_index('file') if os.path.exists(catalog_file) else None
+
+    rows = []
+    for f in sorted(os.listdir(path)):
+        file = os.path.abspath(os.path.join(path, f))
+        if not f.endswith('.nc'):
+            continue
+        if old is not None and file in old.index and old.loc[file, 'mtime'] == os.path.getmtime(file):
+            rows.append(dict(old.loc[file], file=file))
+        else:
+            rows.append(station_summary(file, locations))
+
+    catalog = pd.DataFrame(rows, columns=catalog_columns)
+    catalog.to_csv(catalog_file, index=False)
+
+    return catalog
+
+
+# read a station catalog saved by build_catalog
+def read_catalog(catalog_file):
+    """ Read a station catalog saved by build_catalog.
+
+        Args:
+        catalog_file (string): path of the catalog csv
+    """
+    import pandas as pd
+
+    return pd.read_csv(catalog_file, dtype={'id': str, 'variables': str}, parse_dates=['first', 'last'], keep_default_na=False, na_values={'lat': [''], 'lon': ['']})
+
+
+# select the stations in the catalog that match a query
+def query_catalog(catalog, variables=None, start_date=None, end_date=None, bbox=None, min_completeness=None):
+    """ Select the stations in the catalog that match a query, e.g. stations with Tmin covering 1878-1920 within a bounding box.
+
+        Args:
+        catalog (dataframe): station catalog (from build_catalog or read_catalog)
+        variables (list): variables the stations must have (e.g. ['Tmin'])
+        start_date (string): the stations must start on or before this date
+        end_date (string): the stations must end on or after this date
+        bbox (list): bounding box [lon_min, lon_max, lat_min, lat_max] the stations must be in
+        min_completeness (float): minimum fraction of days with data for each of the variables (0-1)
+    """
+    import pandas as pd
+
+    keep = pd.Series(True, index=catalog.index)
+    for v in variables or []:
+        keep &= catalog['variables'].str.split(';').apply(lambda vs: v in vs)
+        if min_completeness is not None:
+            keep &= catalog[f'{v}_completeness'] >= min_completeness
+    if start_date is not None:
+        keep &= catalog['first'] <= pd.Timestamp(start_date)
+    if end_date is not None:
+        keep &= catalog['last'] >= pd.Timestamp(end_date)
+    if bbox is not None:
+        keep &= catalog['lon'].between(bbox[0], bbox[1]) & catalog['lat'].between(bbox[2], bbox[3])
+
+    return catalog[keep]
+
+
+# lazily open the stations in the catalog that match a query
+def open_stations(catalog, start_date, end_date, variables=None, bbox=None, min_completeness=None):
+    """ Lazily open only the stations in the catalog that match a query (see query_catalog) over the date window start_date to end_date,
+        and combine them into one dataset with a station dimension. Replaces the loop over sorted(os.listdir(path)) in the read in notebooks.
+
+        Args:
+        catalog (dataframe): station catalog (from build_catalog or read_catalog)
+        start_date (string): start of the date window (the stations must start on or before this date)
+        end_date (string): end of the date window (the stations must end on or after this date)
+        variables (list): variables the stations must have (e.g. ['Tmin']), a missing Tmin or Tmax is filled with NaN
+        bbox (list): bounding box [lon_min, lon_max, lat_min, lat_max] the stations must be in
+        min_completeness (float): minimum fraction of days with data for each of the variables (0-1)
+    """
+    import xarray as xr
+
+    matches = query_catalog(catalog, variables, start_date, end_date, bbox, min_completeness)
+    if len(matches) == 0:
+        raise ValueError('no stations in the catalog match the query')
+
+    ds = []
+    for file in matches['file']:
+        d = xr.open_dataset(file, chunks={})
+        d = d.rename({'Date': 'time'}) if 'Date' in d.dims else d
+        d = d.sel(time=slice(f'{start_date}', f'{end_date}'))
+        for v in ['Tmin', 'Tmax']:
+            if v not in d:
+                d[v] = d[[x for x in ['Tmin', 'Tmax'] if x in d][0]]*float('nan')
+        ds.append(d[['Tmin', 'Tmax']])
+
+    obs = xr.concat(ds, dim='station', coords='minimal', compat='override')
+    obs.coords['station'] = list(matches['station'])
+    obs.coords['lat'] = ('station', matches['lat'].values)
+    obs.coords['lon'] = ('station', matches['lon'].values)
+
+    return obs
+
+
+# names of the temperature columns in the other station sources (e.g. Eversleigh)
+source_columns = {'Minimum.Temp..C.': 'Tmin', 'Maximum.Temp..C.': 'Tmax'}
+
+
+# hash the contents of a file
+def file_hash(file):
+    """ Hash (sha1) the contents of a file, reading it in blocks.
+
+        Args:
+        file (string): path of the file
+    """
+    import hashlib
+
+    h = hashlib.sha1()
+    with open(file, 'rb') as f:
+        for block in iter(lambda: f.read(2**20), b''):
+            h.update(block)
+
+    return h.hexdigest()
+
+
+# normalise a slow station source (excel or csv) to a dataframe of Date, Tmin and Tmax
+def convert_source(file):
+    """ Normalise a station source that isn't a Bureau csv (e.g. the homogenised Adelaide excel file or the ; delimited Eversleigh csv)
+        to a dataframe with Date as the index and Tmin and Tmax as float32, with the -9999.9 missing values set to NaN.
+
+        Args:
+        file (string): path of the excel (.xlsx) or csv file
+    """
+    import numpy as np, pandas as pd
+
+    if file.endswith(('.xlsx', '.xls')):
+        df = pd.read_excel(file)
+    else:
+        # the Eversleigh csv is delimited with ; instead of ,
+        with open(file) as f:
+            header = f.readline()
+        df = pd.read_csv(file, delimiter=';' if ';' in header else ',')
+
+    df = df.rename(columns=source_columns)
+    T = df[['Date'] + [v for v in ['Tmin', 'Tmax'] if v in df]].copy()
+    T['Date'] = pd.to_datetime(T['Date'])
+    for v in ['Tmin', 'Tmax']:
+        if v in T:
+            values = T[v].astype('float32')
+            # missing values are set to -9999.9
+            T[v] = values.where(values > -100, np.nan)
+
+    return T.set_index('Date')
+
+
+# read a slow station source through a columnar (parquet) cache
+def read_source(file, cache_dir=None):
+    """ Read a slow station source (see convert_source) through a parquet cache: the first read converts the source and saves it as parquet,
+        later reads come straight from the parquet. The cache is remade when the source changes (its modification time and hash are checked).
+        Each cache is named from the source's file name and a hash of its full path, so sources with the same name can share a cache directory.
+
+        Args:
+        file (string): path of the excel (.xlsx) or csv file (e.g. 'homogenised_glaisher_data_220721.xlsx')
+        cache_dir (string): directory of the cache (default is a .cache directory next to the source)
+    """
+    import os, json, hashlib, pandas as pd
+
+    source = os.path.abspath(file)
+    cache_dir = cache_dir or os.path.join(os.path.dirname(source), '.cache')
+    os.makedirs(cache_dir, exist_ok=True)
+    cache = os.path.join(cache_dir, f'{os.path.basename(file)}.{hashlib.sha1(source.encode()).hexdigest()[:12]}.parquet')
+    sidecar = f'{cache}.json'
+
+    mtime = os.path.getmtime(file)
+    if os.path.exists(cache) and os.path.exists(sidecar):
+        with open(sidecar) as f:
+            info = json.load(f)
+        # only reuse a cache made from this source, and only hash the source if it has been touched since the cache was made
+        if info['source'] == source:
+            if info['mtime'] == mtime:
+                return pd.read_parquet(cache)
+            if info['sha1'] == file_hash(file):
+                info['mtime'] = mtime
+                with open(sidecar, 'w') as f:
+                    json.dump(info, f)
+                return pd.read_parquet(cache)
+
+    T = convert_source(file)
+    T.to_parquet(f'{cache}.tmp', engine='pyarrow')
+    os.replace(f'{cache}.tmp', cache)
+    with open(sidecar, 'w') as f:
+        json.dump({'source': source, 'mtime': mtime, 'sha1': file_hash(file)}, f)
+
+    return T
+
+
+# write daily station data as a memory-mappable station x day store
+def write_memmap(dataset, path):
+    """ Write daily station data as a flat memory-mappable store: a directory with one float32 station x day matrix per variable (e.g. Tmax.f32)
+        and a json sidecar (meta.json) with the stations, their coordinates and the date of the first day. Days missing from the dataset are NaN.
+
+        Args:
+        dataset (xarray): data set of daily temperature with station and time dimensions (e.g. obs)
+        path (string): directory of the store
+    """
+    import os, json, numpy as np, pandas as pd
+
+    os.makedirs(path, exist_ok=True)
+    # make sure every day since the first day has a column
+    time = pd.date_range(dataset.time.values[0], dataset.time.values[-1], freq='D')
+    dataset = dataset.reindex(time=time).transpose('station', 'time')
+
+    variables = [v for v in ['Tmin', 'Tmax'] if v in dataset]
+    for v in variables:
+        store = np.memmap(os.path.join(path, f'{v}.f32'), dtype='float32', mode='w+', shape=(dataset.sizes['station'], len(time)))
+        store[:] = dataset[v].values
+        store.flush()
+        del store
+
+    meta = {'stations': [str(s) for s in dataset.station.values], 'origin': str(time[0].date()), 'days': len(time), 'variables': variables}
+    for c in ['lat', 'lon']:
+        if c in dataset.coords:
+            meta[c] = [float(x) for x in dataset[c].values]
+    with open(os.path.join(path, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+
+    return path
+
+
+# open one variable of a memory-mapped station store
+def open_memmap(path, var):
+    """ Open one variable of a store written by write_memmap as a read-only numpy memmap of station x day (nothing is read until it's used).
+        Returns the memmap and the sidecar metadata (day 0 is meta['origin']).
+
+        Args:
+        path (string): directory of the store
+        var (string): 'Tmin' or 'Tmax'
+    """
+    import os, json, numpy as np
+
+    with open(os.path.join(path, 'meta.json')) as f:
+        meta = json.load(f)
+    store = np.memmap(os.path.join(path, f'{var}.f32'), dtype='float32', mode='r', shape=(len(meta['stations']), meta['days']))
+
+    return store, meta
+
+
+# wrap a memory-mapped station store in xarray without copying it
+def memmap_dataset(path, start_date=None, end_date=None):
+    """ Wrap a store written by write_memmap in an xarray dataset (station, time) without copying it, so it can go straight into the
+        extreme indices functions. Selecting stations (isel/sel with a single station or slice) or a date range only reads those pages from disk.
+
+        Args:
+        path (string): directory of the store
+        start_date (string): first date to include (default is the start of the store)
+        end_date (string): last date to include (default is the end of the store)
+    """
+    import os, json, numpy as np, pandas as pd, xarray as xr
+
+    with open(os.path.join(path, 'meta.json')) as f:
+        meta = json.load(f)
+    stores = {}
+    for v in meta['variables']:
+        file = os.path.join(path, f'{v}.f32')
+        if os.path.exists(file):
+            stores[v] = np.memmap(file, dtype='float32', mode='r', shape=(len(meta['stations']), meta['days']))
+    if not stores:
+        raise FileNotFoundError(f'no variables ({", ".join(meta["variables"])}) found in the store {path}')
+
+    time = pd.date_range(meta['origin'], periods=meta['days'], freq='D')
+    # the date window is a slice of days, so the data stay a view of the memmap
+    i0, i1 = time.slice_indexer(start_date, end_date).indices(len(time))[:2]
+
+    coords = {'station': meta['stations'], 'time': time[i0:i1]}
+    for c in ['lat', 'lon']:
+        if c in meta:
+            coords[c] = ('station', meta[c])
+    data = {v: (('station', 'time'), s[:, i0:i1], {'units': 'degC'}) for v, s in stores.items()}
+
+    return xr.Dataset(data, coords=coords)
@@ -11,6 +11,29 @@ def custom_plot(dataset, ax=None, **plt_kwargs):
     return(ax)
 
     
+# dates of the five major eruptions between 1850-2014 marked on the time series (end of the eruption month for monthly data, year for seasonal data)
+eruption_times = ['1883-08-31', '1902-10-31', '1963-03-31', '1982-04-30', '1991-06-30']
+eruption_years = [1883, 1902, 1963, 1982, 1991]
+
+
+# find which eruption dates are on the time axis of a time series
+def eruption_marks(x):
+    """Return the eruption dates (eruption_times for datetimes, eruption_years for years) that are in x, in one vectorized lookup.
+    
+    Args:
+        x (array): time values of the time series (datetimes or seasonyears)
+    """
+    import numpy as np
+    
+    x = np.asarray(x)
+    if np.issubdtype(x.dtype, np.datetime64):
+        dates = np.array(eruption_times, dtype=x.dtype)
+    else:
+        dates = np.array(eruption_years)
+    
+    return dates[np.isin(dates, x)]
+
+
 # define a function for subplots in the timeseries
 def timeseries_graph(mmm_dataset, p10 = None, p90 = None, ax = None, **kwargs):
     """Create subplots of a time series, use shading to indicate 10th and 90th percentiles.  
@@ -24,7 +47,7 @@ def timeseries_graph(mmm_dataset, p10 = None, p90 = None, ax = None, **kwargs):
         ax (axis): axis
         **kwargs
     """
-    import matplotlib.pyplot as plt, numpy as np
+    import matplotlib.pyplot as plt
     
     # checking if an axis has been defined and if not creates one with function "get current axes"
     if ax is None:
@@ -47,28 +70,11 @@ def timeseries_graph(mmm_dataset, p10 = None, p90 = None, ax = None, **kwargs):
     ax.minorticks_on() # need this line in order to get the minor grid lines 
     ax.grid(which='minor', linestyle=':', linewidth='0.5', color='k')
     
-    if hasattr(mmm_dataset, 'time'):
-        # specify an array of eruption dates so I can mark the dates where erutpions occur on the plot
-        e_dates = [np.array('1883-08-31T00:00:00.000000000', dtype='datetime64[ns]'),
-         np.array('1902-10-31T00:00:00.000000000', dtype='datetime64[ns]'),
-         np.array('1963-03-31T00:00:00.000000000', dtype='datetime64[ns]'),
-         np.array('1982-04-30T00:00:00.000000000', dtype='datetime64[ns]'),
-         np.array('1991-06-30T00:00:00.000000000', dtype='datetime64[ns]')]
-    
-        # Plot a dashed line to show the eruption time for the 5 major eruptions
-        for date in e_dates:
-                if date in mmm_dataset.time.data:
-                    ax.axvline(x=date, color = 'r', linestyle = '--', alpha = 0.9, linewidth='1.5')
-    
-    elif hasattr(mmm_dataset, 'seasonyear'):
-        # specify an array of eruption dates so I can mark the dates where erutpions occur on the plot
-        e_dates = [1883, 1902, 1963, 1982, 1991]
-#         e_season = ['JJA', 'SON', 'MAM', 'MAM', 'JJA']
-    
-        # Plot a dashed line to show the eruption season and year for the 5 major eruptions
-        for s, date in enumerate(e_dates):
-                if date in mmm_dataset.seasonyear.data:
-                    ax.axvline(x=date, color = 'r', linestyle = '--', alpha = 0.9, linewidth='1.5')
+    # Plot a dashed line to show the eruption time (or season year) for the 5 major eruptions
+    if hasattr(mmm_dataset, 'time') or hasattr(mmm_dataset, 'seasonyear'):
+        x = mmm_dataset.time.data if hasattr(mmm_dataset, 'time') else mmm_dataset.seasonyear.data
+        for date in eruption_marks(x):
+            ax.axvline(x=date, color = 'r', linestyle = '--', alpha = 0.9, linewidth='1.5')
     
     
     #label axes
@@ -88,7 +94,7 @@ def timeseries_noP(dataset, ax = None, **kwargs):
         ax (axis): axis
         **kwargs
     """
-    import matplotlib.pyplot as plt, numpy as np
+    import matplotlib.pyplot as plt
     
     # checking if an axis has been defined and if not creates one with function "get current axes"
     if ax is None:
@@ -102,40 +108,11 @@ def timeseries_noP(dataset, ax = None, **kwargs):
     ax.minorticks_on() # need this line in order to get the minor grid lines 
     ax.grid(which='minor', linestyle=':', linewidth='0.5', color='k')
     
-    # specify an array of eruption dates so I can mark the dates where erutpions occur on the plot
-    e_dates = [np.array('1883', dtype='int64'),
-               np.array('1902', dtype='int64'),
-               np.array('1963', dtype='int64'),
-               np.array('1982', dtype='int64'),
-               np.array('1991', dtype='int64')] 
-    
-#     # Plot a dashed line to show the eruption time for the 5 major eruptions
-#     for date in e_dates:
-#         if date in dataset.seasonyear.data:
-#             ax.axvline(x=date, color = 'r', linestyle = '--', alpha = 0.9, linewidth='1.5')
-            
-    if hasattr(dataset, 'time'):
-        # specify an array of eruption dates so I can mark the dates where erutpions occur on the plot
-        e_dates = [np.array('1883-08-31T00:00:00.000000000', dtype='datetime64[ns]'),
-         np.array('1902-10-31T00:00:00.000000000', dtype='datetime64[ns]'),
-         np.array('1963-03-31T00:00:00.000000000', dtype='datetime64[ns]'),
-         np.array('1982-04-30T00:00:00.000000000', dtype='datetime64[ns]'),
-         np.array('1991-06-30T00:00:00.000000000', dtype='datetime64[ns]')]
-    
-        # Plot a dashed line to show the eruption time for the 5 major eruptions
-        for date in e_dates:
-                if date in dataset.time.data:
-                    ax.axvline(x=date, color = 'r', linestyle = '--', alpha = 0.9, linewidth='1.5')
-                    
-    elif hasattr(dataset, 'seasonyear'):
-        # specify an array of eruption dates so I can mark the dates where erutpions occur on the plot
-        e_dates = [1883, 1902, 1963, 1982, 1991]
-#         e_season = ['JJA', 'SON', 'MAM', 'MAM', 'JJA']
-    
-        # Plot a dashed line to show the eruption season and year for the 5 major eruptions
-        for s, date in enumerate(e_dates):
-                if date in dataset.seasonyear.data:
-                    ax.axvline(x=date, color = 'r', linestyle = '--', alpha = 0.9, linewidth='1.5')
+    # Plot a dashed line to show the eruption time (or season year) for the 5 major eruptions
+    if hasattr(dataset, 'time') or hasattr(dataset, 'seasonyear'):
+        x = dataset.time.data if hasattr(dataset, 'time') else dataset.seasonyear.data
+        for date in eruption_marks(x):
+            ax.axvline(x=date, color = 'r', linestyle = '--', alpha = 0.9, linewidth='1.5')
     
     #label axes
     ax.set_xlabel(None)
@@ -144,6 +121,93 @@ def timeseries_noP(dataset, ax = None, **kwargs):
     return ax
 
 
+# define a function for a grid of time series panels (e.g. one per season or month) with a line for each station
+def timeseries_grid(dataset, panel, line='station', order=None, cols=2, colors=None, mean=True, titles=None, ylabel=None, 
+                    minor_grid=True, legend=True, figsize=(10,8), **kwargs):
+    """Create a figure with a grid of time series panels, one for each value of panel (e.g. season or month), each with a line for each value of line (e.g. station) 
+    and the mean of the lines in black.  All the panel data is taken out of the data array in one go, the eruption dates are found with one lookup per panel
+    and the axes are shared.  Replaces looping over panels and stations with timeseries_noP.  
+    Return the figure and the axes.  
+    
+    e.g. timeseries_grid(K_season_anom_T.Tmax, 'season', order=season_order, colors=reds, ylabel=f'Temperature [{deg}C]')
+         timeseries_grid(K_month_anom_T.Tmax, 'time.month', cols=3, colors=reds)
+    
+    Args:
+        dataset (xarray): data array of climate variable with a time or seasonyear dimension (e.g. anomalies of several stations)
+        panel (str): dimension (e.g. 'season') or time component (e.g. 'time.month') to split into panels
+        line (str): dimension to draw as separate lines in each panel (e.g. 'station'), or None for one line
+        order (list): values of panel in the order to plot them (e.g. season_order), default is all values in order
+        cols (int): number of columns of panels
+        colors (list): colour of each line, default is the colour cycle
+        mean (bool): if True: plot the mean of the lines in black
+        titles (list): title of each panel, default is the panel values
+        ylabel (str): label of the y axis of the first column
+        minor_grid (bool): if True: add the minor grid lines (like timeseries_noP)
+        legend (bool): if True: add one legend for the figure below the panels
+        figsize (tuple): size of the figure
+        **kwargs: passed to every line
+    """
+    import matplotlib.pyplot as plt, numpy as np
+    
+    tdim = 'time' if 'time' in dataset.dims else 'seasonyear'
+    x = dataset[tdim].values
+    
+    # panel values of each time step (or of the panel dimension) and which to plot
+    keys = dataset[panel].values
+    order = list(order) if order is not None else list(np.unique(keys))
+    
+    # take all the data out in one go: (panel or time, line, time)
+    dims = [d for d in [panel if panel in dataset.dims else None, line] if d is not None]
+    values = dataset.transpose(*dims, tdim).values
+    if line is None:
+        values = values[..., None, :]
+    labels = dataset[line].values if line is not None else [dataset.name]
+    
+    rows = -(-len(order)//cols)
+    fig, axes = plt.subplots(rows, cols, sharex=True, sharey=True, figsize=figsize, squeeze=False)
+    
+    for k, key in enumerate(order):
+        ax = axes.flat[k]
+        if panel in dataset.dims:
+            px, pv = x, values[list(keys).index(key)]
+        else:
+            # time steps of this panel (e.g. every January)
+            select = keys == key
+            px, pv = x[select], values[..., select]
+        
+        for i, label in enumerate(labels):
+            ax.plot(px, pv[i], color = colors[i] if colors is not None else None, label = f'{label}', **kwargs)
+        # plot the multi-line mean
+        if mean and line is not None:
+            with np.errstate(invalid='ignore'):
+                ax.plot(px, np.nanmean(pv, axis=0), color='k', label = f'Multi-{line} mean')
+        
+        # Plot a dashed line to show the eruption time (or season year) for the 5 major eruptions
+        for date in eruption_marks(px):
+            ax.axvline(x=date, color = 'r', linestyle = '--', alpha = 0.9, linewidth='1.5')
+        
+        ax.grid(which='major', linestyle='-', linewidth='0.5', color='k') # customise major grid
+        if minor_grid:
+            ax.minorticks_on() # need this line in order to get the minor grid lines 
+            ax.grid(which='minor', linestyle=':', linewidth='0.5', color='k')
+        ax.set_title(titles[k] if titles is not None else f'{key}')
+    
+    # remove the unused panels
+    for ax in axes.flat[len(order):]:
+        ax.remove()
+    # set the ylabel for every row
+    if ylabel is not None:
+        for ax in axes[:, 0]:
+            ax.set_ylabel(ylabel)
+    
+    # make one legend for all panels (just use the first axis to get info)
+    if legend:
+        handles, labels = axes.flat[0].get_legend_handles_labels()
+        fig.legend(handles, labels, loc='upper center', bbox_to_anchor=(0.5, 0.05), ncol=3)
+    
+    return fig, axes
+
+
 # define function to plot figures for composite graphs 
 def SEA_plots(mmm_dataset, comp_dataset, p10 = None, p90 = None, color_cycle = None, ax = None, **plt_kwargs):
     """Create subplots for a superposed epoch analysis (SEA) graph.  SEA graph is composed of time series of each eruption contained in the mmm_dataset and the composite (of all eruptions in the mmm_dataset).  Shading is used to show the 10th and 90th percentiles of the composite.   
@@ -191,25 +255,186 @@ def SEA_plots(mmm_dataset, comp_dataset, p10 = None, p90 = None, color_cycle = N
     return ax
 
 
+# reference statistics of stat_sig kept in memory between calls (least recently used first), and how many to keep
+sig_store = {}
+sig_store_size = 16
+
+
+# reference standard deviation (and null distribution) over the base period, reusing it if it has already been calculated
+def sig_reference(dataset, start_date=None, end_date=None, null='normal'):
+    """Find the standard deviation over the base period (and for null='empirical' the sorted absolute values over the base period), 
+    kept in memory (sig_store) so it's only calculated once for the same data and base period (or the reference can be passed on to stat_sig/sig_pvalues). 
+    Lazy (dask) data are keyed on the dask token and in-memory data on the array itself (so changing its values in place isn't noticed), nothing is read to make the key. 
+    Returns the name of the time dimension, the std and the sorted absolute values (None for null='normal'), or a dict of these for each variable of a Dataset.
+    
+    Args:
+        dataset (xarray): xarray of climate variable(s) with a time or seasonyear dimension
+        start_date (date_str): start of the base period (default 1850-01, or 1850 for seasonyears)
+        end_date (date_str): end of the base period (default 1881-01, or 1881 for seasonyears)
+        null (str): 'normal' (p-values from a normal distribution with the base period std) or 'empirical' (p-values from the base period values at each point)
+    """
+    import weakref, numpy as np, xarray as xr
+    
+    if isinstance(dataset, xr.Dataset):
+        return {v: sig_reference(dataset[v], start_date, end_date, null) for v in dataset.data_vars}
+    
+    if hasattr(dataset, 'time'):
+        dim, start_date, end_date = 'time', start_date or '1850-01', end_date or '1881-01'
+    elif hasattr(dataset, 'seasonyear'):
+        dim, start_date, end_date = 'seasonyear', start_date or '1850', end_date or '1881'
+    positions = dataset.get_index(dim).slice_indexer(f'{start_date}', f'{end_date}')
+    base = dataset.isel({dim: positions})
+    
+    # key from the dask graph of the base period, or from the in-memory array and the positions of the base period in it
+    # (held with a weakref, so the key can't be reused by another array and is removed when the array is)
+    owner = None
+    if base.chunks is not None:
+        from dask.base import tokenize
+        key = tokenize(dim, null, base)
+    else:
+        key = ('memory', id(dataset.data), dataset.shape, dim, null, positions.start, positions.stop, positions.step)
+        try:
+            owner = weakref.ref(dataset.data, lambda ref, key=key: sig_store.pop(key, None))
+        except TypeError:
+            key = None
+    
+    if (key in sig_store) and (sig_store[key][1] is None or sig_store[key][1]() is dataset.data):
+        # move to the end so it's the most recently used
+        reference = sig_store.pop(key)[0]
+    else:
+        std = base.std(dim = [dim])
+        null_values = None
+        if null == 'empirical':
+            # absolute base period values at each point, sorted, with missing values as -1 so they never count
+            null_values = np.sort(np.nan_to_num(np.abs(base.transpose(..., dim).values), nan=-1), axis=-1)
+        reference = (dim, std, null_values)
+    
+    # keep in memory and remove the least recently used if there are too many
+    if key is not None:
+        sig_store.pop(key, None)
+        sig_store[key] = (reference, owner)
+        while len(sig_store) > sig_store_size:
+            del sig_store[next(iter(sig_store))]
+    
+    return reference
+
+
+# p-values of the anomalies at every point and time
+def sig_pvalues(dataset, start_date=None, end_date=None, null='normal', reference=None):
+    """Find two sided p-values of the anomalies at every point and time, against a normal distribution with the base period std (null='normal') 
+    or against the base period values at each point (null='empirical', the smallest p-value is 1/(number of base period values + 1), so needs a long base period for fdr).
+    
+    Args:
+        dataset (xarray): xarray of climate variable(s) with a time or seasonyear dimension
+        start_date (date_str): start of the base period (see sig_reference)
+        end_date (date_str): end of the base period (see sig_reference)
+        null (str): 'normal' or 'empirical'
+        reference (tuple or dict): output of sig_reference for the same data, base period and null, instead of finding it again
+    """
+    import numpy as np, xarray as xr
+    from scipy.special import erfc
+    
+    if isinstance(dataset, xr.Dataset):
+        reference = reference or {}
+        return xr.Dataset({v: sig_pvalues(dataset[v], start_date, end_date, null, reference.get(v)) for v in dataset.data_vars}, attrs=dataset.attrs)
+    
+    dim, std, null_values = reference or sig_reference(dataset, start_date, end_date, null)
+    
+    if null == 'normal':
+        return xr.apply_ufunc(erfc, abs(dataset/std)/np.sqrt(2))
+    
+    # count the base period values at least as far from zero, for all points in one sorted search
+    # (each point's values are shifted by a different offset so the rows don't overlap)
+    x = np.abs(dataset.transpose(..., dim).values)
+    n_points, n = int(np.prod(null_values.shape[:-1])), null_values.shape[-1]
+    S = null_values.reshape(n_points, n)
+    offset = 2*np.nanmax([S.max(initial=0), np.nanmax(x, initial=0)]) + 2
+    shift = (np.arange(n_points)*offset)[:, None]
+    row_end = (np.arange(1, n_points + 1)*n)[:, None]
+    count = row_end - np.searchsorted((S + shift).ravel(), x.reshape(n_points, -1) + shift)
+    n_valid = (S >= 0).sum(axis=-1)[:, None]
+    p = ((count + 1)/(n_valid + 1)).reshape(x.shape)
+    p[np.isnan(x)] = np.nan
+    
+    return dataset.transpose(..., dim).copy(data=p).transpose(*dataset.dims)
+
+
+# false discovery rate (Benjamini-Hochberg) field significance for each time
+def fdr_mask(pvalues, dim, q=0.05):
+    """Find the points that are significant at each time when controlling the false discovery rate (Benjamini-Hochberg) across the map at level q.
+    
+    Args:
+        pvalues (xarray): p-values of the anomalies (e.g. from sig_pvalues)
+        dim (str): time dimension ('time' or 'seasonyear')
+        q (float): false discovery rate (e.g. 0.05)
+    """
+    import numpy as np
+    
+    p = pvalues.transpose(dim, ...).values
+    p2 = p.reshape(p.shape[0], -1)
+    m = np.isfinite(p2).sum(axis=1)
+    
+    # sort each map (missing values last) and find the largest k with p_(k) <= k/m*q
+    ps = np.sort(np.where(np.isfinite(p2), p2, np.inf), axis=1)
+    k = np.arange(1, p2.shape[1] + 1)
+    below = ps <= k[None, :]/np.maximum(m, 1)[:, None]*q
+    kmax = np.where(below, k[None, :], 0).max(axis=1)
+    threshold = np.where(kmax > 0, ps[np.arange(len(ps)), np.maximum(kmax - 1, 0)], -1)
+    
+    mask = p2 <= threshold[:, None]
+    return pvalues.transpose(dim, ...).copy(data=mask.reshape(p.shape)).transpose(*pvalues.dims)
+
+
 # find where the anomalies are outside a threshold of +/- 2 standard deviations 
-def stat_sig(dataset):
-    """Find where the anomalies are outside a threshold of +/- 2 standard deviations.  Standard deviation calculated based on an 1850-1880 climatology.  
+def stat_sig(dataset, start_date=None, end_date=None, fdr=None, null='normal', dtype=bool, reference=None):
+    """Find where the anomalies are outside a threshold of +/- 2 standard deviations.  Standard deviation calculated based on an 1850-1880 climatology (or the base period given),
+    with the base period statistics from sig_reference (or the reference given). Returns a boolean (or uint8) mask, True where significant.  
     
     Args:
         dataset (xarray): xarray of climate variable(s)
+        start_date (date_str): start of the base period (default 1850-01, or 1850 for seasonyears)
+        end_date (date_str): end of the base period (default 1881-01, or 1881 for seasonyears)
+        fdr (float): if given, use field significance instead: points significant when the false discovery rate across the map is controlled at this level (e.g. 0.05)
+        null (str): distribution for the p-values used with fdr, 'normal' or 'empirical' (see sig_pvalues)
+        dtype (type): type of the mask (bool or 'uint8')
+        reference (tuple or dict): output of sig_reference for the same data and base period (with the same null if fdr is given), instead of finding it again
     """    
     import xarray as xr
     
-    # calculate the standard deviation 
-    if hasattr(dataset, 'time'):
-        std = dataset.sel(time = slice('1850-01', '1881-01')).std(dim = ['time'])
-    elif hasattr(dataset, 'seasonyear'):
-        std = dataset.sel(seasonyear = slice('1850', '1881')).std(dim = ['seasonyear'])
+    # each variable of a Dataset gets its own reference (and field significance)
+    if isinstance(dataset, xr.Dataset):
+        reference = reference or {}
+        return xr.Dataset({v: stat_sig(dataset[v], start_date, end_date, fdr, null, dtype, reference.get(v)) for v in dataset.data_vars}, attrs=dataset.attrs)
+    
+    if fdr is None:
+        dim, std, null_values = reference or sig_reference(dataset, start_date, end_date)
+        # mark points oustide the 2 standard deviation threshold for all times at once
+        sig = abs(dataset) > 2*std
+    else:
+        dim = 'time' if hasattr(dataset, 'time') else 'seasonyear'
+        sig = fdr_mask(sig_pvalues(dataset, start_date, end_date, null, reference), dim, fdr)
+    
+    return sig.astype(dtype)
+
+
+# projection and coastline objects shared by all the map plots (one set per process, created the first time they're needed)
+map_objects = {}
+
+
+# get the projection, data transform and coastline feature for the map plots, reusing them after the first call
+def map_features():
+    """Return the projection of the map axes (PlateCarree centred on 180), the transform of the data (PlateCarree) and the coastline feature, 
+    created once per process so figures drawn in a loop (or in render_maps) don't rebuild them for every subplot.
+    """
+    import cartopy.crs as ccrs, cartopy.feature as cfeature
     
-    # mark points oustide the 2 standard deviation threshold with a 100 (and non significant points with a zero)
-    sig = xr.where((dataset < - 2*std) | (dataset > 2*std), 100, 0)
+    if not map_objects:
+        map_objects['projection'] = ccrs.PlateCarree(180)
+        map_objects['transform'] = ccrs.PlateCarree()
+        # same as ax.coastlines(): resolution picked from the extent of each axis
+        map_objects['coastline'] = cfeature.COASTLINE
     
-    return sig 
+    return map_objects['projection'], map_objects['transform'], map_objects['coastline']
 
 
 #define a function for spatial plots, plotting a dataset at 4 different time intervals
@@ -228,8 +453,9 @@ def spatial_plot(rows, cols, dataset, cmax, times, titles, colours, units, std):
         units (str): units for axes label
         std (int): if std==1: use stippling
     """
-    import matplotlib.pyplot as plt, cartopy.crs as ccrs, numpy as np
+    import matplotlib.pyplot as plt, numpy as np
     
+    projection, transform, coastline = map_features()
     fig = plt.figure()
     axs = []
 
@@ -247,7 +473,7 @@ def spatial_plot(rows, cols, dataset, cmax, times, titles, colours, units, std):
     
     for i, d in enumerate(times):    
         # Add a subplot with a projection    
-        ax = fig.add_subplot(rows, cols, i+1, projection=ccrs.PlateCarree(180))        
+        ax = fig.add_subplot(rows, cols, i+1, projection=projection)        
         # Select the date and corresponding data and plot it    
         # We'll add a separate colour bar, but make sure all plots share the same min and max colour value
         if hasattr(dataset, 'time'):
@@ -255,21 +481,21 @@ def spatial_plot(rows, cols, dataset, cmax, times, titles, colours, units, std):
         elif hasattr(dataset, 'seasonyear'):
             data = dataset.sel(seasonyear = times[i]) 
         
-        C = data.plot(ax=ax, add_colorbar=False, transform=ccrs.PlateCarree(), cmap = cmap, vmin=cmax[0], vmax=cmax[1])
+        C = data.plot(ax=ax, add_colorbar=False, transform=transform, cmap = cmap, vmin=cmax[0], vmax=cmax[1])
         # hatching where anomalies exceed a threshold of 2 standard deviations
         if std == 1:
             if hasattr(dataset, 'time'):
                 data2 = sig_dataset.sel(time = times[i]).mean(dim='time')
-                data2.plot.contourf(levels=[99, 1e10], hatches=[None,'..'], colors='none', add_colorbar=False, transform=ccrs.PlateCarree())
+                data2.plot.contourf(levels=[0.99, 1e10], hatches=[None,'..'], colors='none', add_colorbar=False, transform=transform)
             elif hasattr(dataset, 'seasonyear'): # try this instead if the dataset is seasonal
-                data2 = sig_dataset.sel(seasonyear = times[i])#.mean(dim='seasonyear')
-                data2.plot.contourf(levels=[99, 1e10], hatches=[None,'..'], colors='none', add_colorbar=False, transform=ccrs.PlateCarree())
+                data2 = sig_dataset.sel(seasonyear = times[i]).astype(float)#.mean(dim='seasonyear')
+                data2.plot.contourf(levels=[0.99, 1e10], hatches=[None,'..'], colors='none', add_colorbar=False, transform=transform)
         
         # axes
-        ax.coastlines()
+        ax.add_feature(coastline)
         # set the axis limits to be slihtly larger (2.5 degrees wither way) than the upper and lower bounds of the dataset 
         if (len(data.lon) < int(175/1.5)) & (len(data.lat) < int(175/1.5)):
-            ax.set_extent([data.lon[0] - 2.5, data.lon[-1] + 2.5, data.lat[0] - 2.5, data.lat[-1] + 2.5], crs=ccrs.PlateCarree())
+            ax.set_extent([data.lon[0] - 2.5, data.lon[-1] + 2.5, data.lat[0] - 2.5, data.lat[-1] + 2.5], crs=transform)
         # add on grid lines for longitude and latitude at specified range and spacing
         #ax.gridlines(xlocs=range(-180,181,20), ylocs=range(-80,81,20),draw_labels=False) 
         ax.gridlines(xlocs=range(-160,181,20), ylocs=range(-80,81,20),draw_labels=True)
@@ -302,22 +528,23 @@ def spatial_clim_plot(data, cmax, colour, units, titles=None):
         units (str): units for axes label
         titles (date_str): dictionary of titles (str) for each subplot
     """
-    import matplotlib.pyplot as plt, cartopy.crs as ccrs, numpy as np
+    import matplotlib.pyplot as plt, numpy as np
     
+    projection, transform, coastline = map_features()
     fig = plt.figure()
 # set discrete colourbar with 15 intervals
     cmap = plt.get_cmap(f'{colour}')#, 15)
       
     # Add a subplot with a projection    
-    ax = fig.add_subplot(1, 1, 1, projection=ccrs.PlateCarree(180))        
+    ax = fig.add_subplot(1, 1, 1, projection=projection)        
 
-    C = data.plot(ax=ax, add_colorbar=False, transform=ccrs.PlateCarree(), cmap = cmap, vmin=cmax[0], vmax=cmax[1])
+    C = data.plot(ax=ax, add_colorbar=False, transform=transform, cmap = cmap, vmin=cmax[0], vmax=cmax[1])
 
     # axes
-    ax.coastlines()
+    ax.add_feature(coastline)
     # set the axis limits to be slihtly larger (2.5 degrees wither way) than the upper and lower bounds of the dataset 
     if (len(data.lon) < int(175/1.5)) & (len(data.lat) < int(175/1.5)):
-        ax.set_extent([data.lon[0] - 2.5, data.lon[-1] + 2.5, data.lat[0] - 2.5, data.lat[-1] + 2.5], crs=ccrs.PlateCarree())
+        ax.set_extent([data.lon[0] - 2.5, data.lon[-1] + 2.5, data.lat[0] - 2.5, data.lat[-1] + 2.5], crs=transform)
     # add on grid lines for longitude and latitude at specified range and spacing
     ax.gridlines(xlocs=range(-160,181,20), ylocs=range(-80,81,20),draw_labels=True)
     # add titles for each subplot
@@ -336,8 +563,9 @@ def spatial_clim_plot(data, cmax, colour, units, titles=None):
 # define a fucntion to plot the standard deviation values calculated at each time point
 def std_plot(rows, cols, dataset, cmax, titles, colours, units):
     
-    import xarray as xr, matplotlib.pyplot as plt, cartopy.crs as ccrs, numpy as np
+    import xarray as xr, matplotlib.pyplot as plt, numpy as np
     
+    projection, transform, coastline = map_features()
     fig = plt.figure()
     axs = []
     
@@ -345,17 +573,17 @@ def std_plot(rows, cols, dataset, cmax, titles, colours, units):
     
     for i, data in enumerate(dataset):    
         # Add a subplot with a projection    
-        ax = fig.add_subplot(rows, cols, i+1, projection=ccrs.PlateCarree(180))        
+        ax = fig.add_subplot(rows, cols, i+1, projection=projection)        
         # We'll add a separate colour bar, but make sure all plots share the same min and max colour value  
         
-        C = data.plot(ax=ax, add_colorbar=False, transform=ccrs.PlateCarree(), cmap = cmap, vmin=cmax[0], vmax=cmax[1])
+        C = data.plot(ax=ax, add_colorbar=False, transform=transform, cmap = cmap, vmin=cmax[0], vmax=cmax[1])
         # hatching where anomalies exceed a threshold of 2 standard deviations
    
         # axes
-        ax.coastlines()
+        ax.add_feature(coastline)
         # set the axis limits to be slihtly larger (2.5 degrees wither way) than the upper and lower bounds of the dataset 
         if (len(data.lon) < int(175/1.5)) & (len(data.lat) < int(175/1.5)):
-            ax.set_extent([data.lon[0] - 2.5, data.lon[-1] + 2.5, data.lat[0] - 2.5, data.lat[-1] + 2.5], crs=ccrs.PlateCarree())
+            ax.set_extent([data.lon[0] - 2.5, data.lon[-1] + 2.5, data.lat[0] - 2.5, data.lat[-1] + 2.5], crs=transform)
         # add on grid lines for longitude and latitude at specified range and spacing
         #ax.gridlines(xlocs=range(-180,181,20), ylocs=range(-80,81,20),draw_labels=False) 
         ax.gridlines(xlocs=range(-160,181,20), ylocs=range(-80,81,20),draw_labels=True)
@@ -374,6 +602,73 @@ def std_plot(rows, cols, dataset, cmax, titles, colours, units):
     return fig
 
 
+# names of the map plots render_maps can draw
+map_plots = ['spatial_plot', 'spatial_clim_plot', 'std_plot']
+
+
+# switch a worker process to the non-interactive backend (runs once when each worker of render_maps starts)
+def headless():
+    import matplotlib
+    matplotlib.use('Agg')
+
+
+# draw one map figure and save it (runs in a process pool so it needs to be at the top of the module)
+def render_map(job, path='', dpi=150):
+    """Draw one figure of a render_maps job, save it and close it. Returns the path of the file.
+    
+    Args:
+        job (dict): plot (name of the map function: 'spatial_plot', 'spatial_clim_plot' or 'std_plot'), file (name of the file to write), 
+                    figsize (optional, [width, height] in inches) and the arguments of the map function (e.g. rows, cols, dataset, cmax, times, titles, colours, units, std)
+        path (str): directory to write the file to
+        dpi (int): resolution of the file
+    """
+    import os, matplotlib.pyplot as plt
+    
+    job = dict(job)
+    plot, file, figsize = job.pop('plot'), job.pop('file'), job.pop('figsize', None)
+    if plot not in map_plots:
+        raise ValueError(f'plot must be one of {map_plots}, not {plot}')
+    fig = globals()[plot](**job)
+    if figsize is not None:
+        fig.set_size_inches(figsize)
+    
+    file = os.path.join(path, file)
+    fig.savefig(file, dpi=dpi, bbox_inches='tight')
+    plt.close(fig)
+    
+    return file
+
+
+# draw and save a batch of map figures across a pool of processes
+def render_maps(jobs, path='', n_workers=None, dpi=150):
+    """Draw and save a batch of map figures (spatial_plot, spatial_clim_plot and std_plot) without displaying them, split across a pool of processes.
+    Each worker uses the Agg backend and reuses its projection and coastline objects (map_features) for all its figures. 
+    Returns the paths of the files, in the order of the jobs.
+    
+    e.g. jobs = [{'plot': 'spatial_plot', 'file': f'tas_{s}.png', 'rows': 2, 'cols': 2, 'dataset': ds.sel(season=s), 'cmax': [-1, 1], 'times': times, 
+                  'titles': titles, 'colours': 'RdBu_r', 'units': '°C', 'std': 1} for s in ['DJF', 'MAM', 'JJA', 'SON']]
+    
+    Args:
+        jobs (list): list of dictionaries, one for each figure (see render_map)
+        path (str): directory to write the files to
+        n_workers (int): number of processes (None = number of CPUs, 1 = no process pool, draws in this process with the current backend)
+        dpi (int): resolution of the files
+    """
+    import os
+    from concurrent.futures import ProcessPoolExecutor
+    
+    if path:
+        os.makedirs(path, exist_ok=True)
+    # compute the data now (without loading the caller's objects in place) so each worker gets the values rather than the files
+    jobs = [{k: (v.compute() if hasattr(v, 'compute') else v) for k, v in job.items()} for job in jobs]
+    
+    if n_workers == 1:
+        return [render_map(job, path, dpi) for job in jobs]
+    
+    with ProcessPoolExecutor(n_workers, initializer=headless) as pool:
+        return list(pool.map(render_map, jobs, [path]*len(jobs), [dpi]*len(jobs)))
+
+
 # define a function for subplots of the nino3.4 index over time 
 def nino34_plot(ds, e_date, thold, ax = None, **kwargs):
     """Create subplot of timeseries of SST anomalies for NINO34 index.  
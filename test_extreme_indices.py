@@ -0,0 +1,40 @@
+# checks of the extreme indices functions against simple (slow) versions
+import numpy as np, pandas as pd, xarray as xr
+import Extreme_indices_functions as E
+
+
+# percentiles of the window of consecutive days centred on each calendar day, one day at a time
+def brute_force_calendar_day(base, quantiles, window):
+    time = pd.DatetimeIndex(base.time.values)
+    day = E.calendar_day(base.time).values
+    half = window // 2
+    thresholds = np.full((366, len(quantiles)), np.nan)
+    for d in range(1, 367):
+        values = []
+        for t in time[day == d]:
+            values.append(base.sel(time=slice(t - pd.Timedelta(days=half), t + pd.Timedelta(days=half))).values)
+        if values:
+            thresholds[d - 1] = np.quantile(np.concatenate(values), quantiles)
+    return thresholds
+
+
+def test_calendar_day_quantile_non_leap_base():
+    time = pd.date_range('1961-01-01', '1963-12-31')
+    base = xr.DataArray(np.random.default_rng(0).normal(size=len(time)), dims=['time'], coords={'time': time})
+    quantiles = [0.1, 0.9]
+
+    thresholds = E.calendar_day_quantile(base, quantiles, window=5).values
+    expected = brute_force_calendar_day(base, quantiles, 5)
+    # 29th February isn't in the base period, so it has 28th February's percentiles
+    expected[59] = expected[58]
+
+    np.testing.assert_allclose(thresholds, expected)
+
+
+def test_calendar_day_quantile_leap_day():
+    time = pd.date_range('1963-01-01', '1966-12-31')
+    base = xr.DataArray(np.random.default_rng(1).normal(size=len(time)), dims=['time'], coords={'time': time})
+
+    thresholds = E.calendar_day_quantile(base, [0.1, 0.9], window=5).values
+
+    np.testing.assert_allclose(thresholds, brute_force_calendar_day(base, [0.1, 0.9], 5))